@@ -0,0 +1,111 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+
+
+CATEGORIES = ['verbs', 'nouns', 'case', 'number', 'animacy', 'relation', 'prepositions', 'combinations', 'filtered']
+
+
+def checksum(path):
+    '''Returns md5 checksum of a file.'''
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class Aggregate:
+    '''Persistent joined statistics of conllu-files, which is updated incrementally.
+    Directory of an aggregate contains:
+        - `counts.sqlite` with joined counts and the list of source files with checksums of their json-files,
+        - copies of json-files of the sources, which are needed to subtract counts of a removed or replaced file.
+    Updating costs time proportional to the size of added, removed and replaced files.'''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(path, 'counts.sqlite'))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sources (file TEXT PRIMARY KEY, checksum TEXT, size INTEGER, mtime INTEGER, sentences INTEGER, words INTEGER)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS counts (category TEXT, key TEXT, count INTEGER, PRIMARY KEY (category, key)) WITHOUT ROWID')
+        self.connection.commit()
+
+    def sources(self):
+        '''Returns a dictionary of source files with their checksums, sizes and modification times of json-files.'''
+        return {file: (checksum, size, mtime) for file, checksum, size, mtime in self.connection.execute('SELECT file, checksum, size, mtime FROM sources')}
+
+    def _apply(self, statistics, sign):
+        for category in CATEGORIES:
+            self.connection.executemany(
+                'INSERT INTO counts VALUES (?, ?, ?) ON CONFLICT (category, key) DO UPDATE SET count = count + excluded.count',
+                ((category, key, sign*count) for key, count in statistics[category].items())
+            )
+            if sign < 0:
+                self.connection.executemany(
+                    'DELETE FROM counts WHERE category = ? AND key = ? AND count <= 0',
+                    ((category, key) for key in statistics[category])
+                )
+
+    def _snapshot(self, file):
+        return os.path.join(self.path, file + '.json')
+
+    def add(self, file, json_path, file_checksum=None):
+        '''Adds counts of a source file from its json-file.'''
+        with open(json_path, encoding='utf-8') as f:
+            statistics = json.load(f)
+        shutil.copyfile(json_path, self._snapshot(file))
+        self._apply(statistics, 1)
+        self.connection.execute('INSERT INTO sources VALUES (?, ?, ?, ?, ?, ?)', (
+            file, file_checksum or checksum(json_path), os.path.getsize(json_path), os.stat(json_path).st_mtime_ns,
+            statistics['sentences'], statistics['words']
+        ))
+        self.connection.commit()
+
+    def remove(self, file):
+        '''Subtracts counts of a source file.'''
+        with open(self._snapshot(file), encoding='utf-8') as f:
+            statistics = json.load(f)
+        self._apply(statistics, -1)
+        self.connection.execute('DELETE FROM sources WHERE file = ?', (file,))
+        self.connection.commit()
+        os.remove(self._snapshot(file))
+
+    def update(self, json_paths: dict):
+        '''Makes the aggregate contain exactly the given source files (a dictionary of files and paths of their json-files).
+        Returns lists of added, removed and replaced files.'''
+        sources = self.sources()
+        changes = {'added': [], 'removed': [], 'replaced': []}
+        for file in sources:
+            if file not in json_paths:
+                self.remove(file)
+                changes['removed'].append(file)
+        for file, json_path in json_paths.items():
+            if file not in sources:
+                self.add(file, json_path)
+                changes['added'].append(file)
+                continue
+            file_checksum, size, mtime = sources[file]
+            if (size, mtime) == (os.path.getsize(json_path), os.stat(json_path).st_mtime_ns):
+                continue
+            new_checksum = checksum(json_path)
+            if new_checksum != file_checksum:
+                self.remove(file)
+                self.add(file, json_path, new_checksum)
+                changes['replaced'].append(file)
+            else:
+                self.connection.execute('UPDATE sources SET size = ?, mtime = ? WHERE file = ?', (os.path.getsize(json_path), os.stat(json_path).st_mtime_ns, file))
+        self.connection.commit()
+        return changes
+
+    def statistics(self):
+        '''Returns joined statistics in the format of `Statistics.join_statistics` (frequency dictionaries sorted by frequency).'''
+        sentences, words = self.connection.execute('SELECT COALESCE(SUM(sentences), 0), COALESCE(SUM(words), 0) FROM sources').fetchone()
+        statistics = {'sentences': sentences, 'words': words}
+        for category in CATEGORIES:
+            statistics[category] = dict(self.connection.execute('SELECT key, count FROM counts WHERE category = ? ORDER BY count DESC, key', (category,)))
+        return statistics
+
+    def close(self):
+        self.connection.close()
@@ -4,6 +4,11 @@
 # python3 -m deeppavlov install syntax_ru_syntagrus_bert
 # python3 -m pip install conllu
 # python3 -m pip install razdel
+#
+# usage:
+# python3 analyzing.py            parse `.txt` files of the current directory to `out/<file>.conllu`
+# python3 analyzing.py --stream   count statistics of parsed sentences in memory (`out/<file>.json`, see `stream`),
+#                                 add `--conllu` to also write conllu-files
 
 
 import time
@@ -11,47 +16,384 @@ from tqdm import tqdm
 import re
 import json
 import os
+import sys
+import queue
+import threading
+import multiprocessing
+import zlib
+import codecs
+from collections import defaultdict
 from deeppavlov import build_model, configs
 from razdel import sentenize, tokenize
 from conllu import parse
+from metrics import metrics
+from extracting_verb_model import Statistics
+
+
+# number of sentences parsed by deeppavlov model at once
+BATCH_SIZE = 32
+# number of sentences collected (across lines and files) before sorting them by length into batches
+BUFFER_SIZE = 4096
+# number of deeppavlov model replicas running in separate processes (on CPU)
+WORKERS = 1
+# encodings of input files (in order of priority) and size of a sample (in bytes) for detecting the encoding
+ENCODINGS = ['utf-8', 'cp1251']
+SAMPLE_SIZE = 1 << 20
+# number of buffers waiting between the stages of streaming mode (tokenizing -> parsing -> counting)
+QUEUE_SIZE = 4
+# number of example sentences kept for each combination in streaming mode (for `Statistics.find_text`)
+EXAMPLES = 10
+
+dp_model = None
 
 
 # importing deeppavlov model
-dp_model = build_model("ru_syntagrus_joint_parsing", download=True)
+def load_model():
+    global dp_model
+    dp_model = build_model("ru_syntagrus_joint_parsing", download=True)
 
 
-def analyze_text(text):
-    parsed_sentences = []
+def split_text(text):
+    '''Returns sentences of a text with their tokens.'''
+    sentences = []
     if len(text) > 65 and not re.match('https?://', text):
-        sentences = [sent.text for sent in list(sentenize(text))]
-        for sent in sentences:
+        for sent in [sent.text for sent in list(sentenize(text))]:
             if 'Продолжение читайте в газете "Вестник района"' not in sent:
                 tokens = [token.text for token in list(tokenize(sent))]
                 if len(tokens) < 400:
-                    parsed_sentences.append((sent, parse(dp_model([tokens])[0])[0]))
-    return parsed_sentences
+                    sentences.append((sent, tokens))
+    return sentences
+
+def parse_batch(batch):
+    '''Parses a batch of tokenized sentences with deeppavlov model.'''
+    return [parse(result)[0] for result in dp_model(batch)]
+
+def analyze_text(text):
+    sentences = split_text(text)
+    if not sentences:
+        return []
+    return list(zip([sent for sent, _ in sentences], parse_batch([tokens for _, tokens in sentences])))
 
 def write_to_conllu(parsed_texts, name):
-    with open('out/' + name + '.conllu', 'a', encoding = 'utf-8') as f:
-        for sent in parsed_texts:
-            f.write('# text = ' + sent[0] + '\n')
-            f.write(sent[1].serialize())
+    '''Appends parsed sentences to a temporary conllu-file of an input file. Returns written data.'''
+    data = ''.join(['# text = ' + sent + '\n' + tokenlist.serialize() for sent, tokenlist in parsed_texts]).encode('utf-8')
+    with open('out/' + name + '.conllu.part', 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return data
+
+
+class Checkpoint:
+    '''Manifest of parsing progress. For each input file it keeps the number of fully written lines,
+    the size and crc32 checksum of the output written so far and whether the file is finished.
+    Output is written to `out/<file>.conllu.part` and renamed to `out/<file>.conllu` when the file is finished.'''
+
+    def __init__(self, path='out/manifest.json'):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.files = json.load(f)
+
+    def save(self):
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.files, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
 
+    def resume(self, name):
+        '''Returns the number of lines of a file which have already been parsed (None if the file is finished).
+        Output written after the last checkpoint is truncated; if it does not match the checksum, parsing starts over.'''
+        entry = self.files.get(name)
+        if entry and entry['finished']:
+            return None
+        part = 'out/' + name + '.conllu.part'
+        if entry and os.path.exists(part) and os.path.getsize(part) >= entry['offset']:
+            with open(part, 'r+b') as f:
+                f.truncate(entry['offset'])
+                crc = 0
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    crc = zlib.crc32(chunk, crc)
+            if crc == entry['crc32']:
+                return entry['line']
+            print(f'Checksum mismatch for `{part}`, parsing `{name}` from the beginning.')
+        open(part, 'wb').close()
+        self.files[name] = {'line': 0, 'offset': 0, 'crc32': 0, 'finished': False}
+        return 0
 
-list_of_files = [file for file in os.listdir() if '.txt' in file]
-encodings = ['utf-8', 'cp1251']
+    def update(self, name, line, data):
+        entry = self.files[name]
+        entry['line'] = line
+        entry['offset'] += len(data)
+        entry['crc32'] = zlib.crc32(data, entry['crc32'])
 
-for file in list_of_files:
-    print('Start processing file: ', file)
-    for enc in encodings:
+    def finish(self, name):
+        os.replace('out/' + name + '.conllu.part', 'out/' + name + '.conllu')
+        self.files[name]['finished'] = True
+        self.save()
+
+
+def detect_encoding(file):
+    '''Returns the first of ENCODINGS which decodes a sample from the beginning of a file (None if neither does).'''
+    with open(file, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    for enc in ENCODINGS:
         try:
-            with open(file, 'r', encoding=enc) as f:
-                result = f.readlines()
+            codecs.getincrementaldecoder(enc)().decode(sample, final=len(sample) < SAMPLE_SIZE)
         except UnicodeDecodeError:
-            pass
-    for line in tqdm(result):
-        texts = analyze_text(line)
-        if texts:
-            write_to_conllu(texts, file)
-    print('Finished: ', file)
-    print('-'*100)
\ No newline at end of file
+            continue
+        return enc
+    return None
+
+def iter_lines(files, checkpoint, report):
+    '''Yields (file, line number, sentences with tokens) for all lines of files which have not been parsed yet;
+    (file, None, None) marks the end of a file. Lines are read lazily; counters of read lines and sentences,
+    detected encoding and decoding errors are collected in `report` for each file. A file which fails to decode is ended
+    at the line before the error, so its parsed lines (and their statistics in streaming mode) are saved as a finished file
+    and the error is reported. Without a checkpoint all lines are yielded.'''
+    for file in files:
+        if checkpoint and checkpoint.files.get(file, {}).get('finished'):
+            print('Already parsed: ', file)
+            continue
+        counters = report[file] = {'encoding': detect_encoding(file), 'lines': 0, 'sentences': 0, 'error': None}
+        if counters['encoding'] is None:
+            counters['error'] = f'does not match encodings {ENCODINGS}'
+            print(f'Skipping file {file}: {counters["error"]}')
+            continue
+        skip = checkpoint.resume(file) if checkpoint else 0
+        print('Start processing file: ', file)
+        if skip:
+            print(f'Resuming from line {skip + 1}')
+        try:
+            with open(file, 'rb') as f:
+                for line_number, line in enumerate(tqdm(f), 1):
+                    # lines are read in binary mode, so `\r\n` is normalized as reading in text mode would
+                    line = line.decode(counters['encoding'])
+                    if line.endswith('\r\n'):
+                        line = line[:-2] + '\n'
+                    counters['lines'] += 1
+                    if line_number > skip:
+                        split_start = time.perf_counter()
+                        sentences = split_text(line)
+                        metrics.add_time('split', time.perf_counter() - split_start)
+                        counters['sentences'] += len(sentences)
+                        yield file, line_number, sentences
+        except UnicodeDecodeError as error:
+            counters['error'] = f'line {counters["lines"] + 1}: {error}'
+            print(f'Stopped processing file {file}: {counters["error"]} (lines before it are kept)')
+        yield file, None, None
+
+def iter_buffers(items):
+    '''Groups items of `iter_lines` into buffers of at least BUFFER_SIZE sentences (the last one can be smaller).'''
+    buffer = []
+    buffered = 0
+    for item in items:
+        buffer.append(item)
+        buffered += len(item[2] or [])
+        if buffered >= BUFFER_SIZE:
+            yield buffer
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield buffer
+
+def parse_sentences(sentences, pool=None):
+    '''Parses tokenized sentences in batches of sentences with similar length.
+    Returns parsed sentences in the original order.'''
+    order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+    positions = [order[i:i+BATCH_SIZE] for i in range(0, len(order), BATCH_SIZE)]
+    batches = [[sentences[i] for i in batch] for batch in positions]
+    results = pool.imap(parse_batch, batches) if pool else map(parse_batch, batches)
+    parsed = [None] * len(sentences)
+    for batch, result in zip(positions, results):
+        for i, tokenlist in zip(batch, result):
+            parsed[i] = tokenlist
+    return parsed
+
+
+class Throughput:
+    '''Counts parsed sentences per second.'''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sentences = 0
+
+    def update(self, sentences):
+        self.sentences += sentences
+
+    def __str__(self):
+        elapsed = time.perf_counter() - self.start
+        return f'Parsed {self.sentences} sentences in {elapsed:.1f} s: {self.sentences/elapsed:.2f} sentences/sec (batch size {BATCH_SIZE}, workers {WORKERS})'
+
+
+def flush(buffer, pool, checkpoint, throughput):
+    '''Parses sentences of buffered lines, writes them in the original order and saves the checkpoint.'''
+    tokenized = [tokens for _, _, sentences in buffer if sentences for _, tokens in sentences]
+    with metrics.timer('parse'):
+        parsed = iter(parse_sentences(tokenized, pool))
+    metrics.count('sentences', len(tokenized))
+    metrics.count('tokens', sum([len(tokens) for tokens in tokenized]))
+    write_start = time.perf_counter()
+    texts = []
+    for i, (file, line_number, sentences) in enumerate(buffer):
+        if sentences is None:
+            checkpoint.finish(file)
+            print('Finished: ', file)
+            print(throughput)
+            print('-'*100)
+            continue
+        texts.extend([(sent, next(parsed)) for sent, _ in sentences])
+        throughput.update(len(sentences))
+        if (i + 1 == len(buffer)) or (buffer[i + 1][0] != file) or (buffer[i + 1][2] is None):
+            checkpoint.update(file, line_number, write_to_conllu(texts, file))
+            texts = []
+    checkpoint.save()
+    metrics.add_time('write', time.perf_counter() - write_start)
+    metrics.tick()
+
+
+def start_model():
+    '''Loads deeppavlov model in this process or returns a pool of WORKERS processes with their own models.'''
+    if WORKERS > 1:
+        return multiprocessing.Pool(WORKERS, initializer=load_model)
+    load_model()
+    return None
+
+def stop_model(pool):
+    if pool:
+        pool.close()
+        pool.join()
+
+def print_report(report):
+    for file, counters in report.items():
+        print(f'{file}: encoding {counters["encoding"]}, {counters["lines"]} lines, {counters["sentences"]} sentences' + \
+            (f', error: {counters["error"]}' if counters['error'] else ''))
+    print('Files which match neither encoding or failed to decode:', len([file for file in report if report[file]['error']]))
+
+
+def main(files):
+    pool = start_model()
+    checkpoint = Checkpoint()
+    throughput = Throughput()
+    report = {}
+    for buffer in iter_buffers(iter_lines(files, checkpoint, report)):
+        flush(buffer, pool, checkpoint, throughput)
+    stop_model(pool)
+    print(throughput)
+    metrics.emit('analyzing')
+    print(metrics)
+    print_report(report)
+
+
+class Counting:
+    '''Counting stage of streaming mode: statistics of parsed sentences of each file are counted in memory by `Statistics`
+    and saved to `out/<file>.json` (as `get_statistics` of `out/<file>.conllu` would) with up to EXAMPLES sentences
+    for each combination in `out/<file>.examples.json`. If `write_conllu` is True, parsed sentences are also written to `out/<file>.conllu`.'''
+
+    def __init__(self, statistics, write_conllu=False):
+        self.statistics = statistics
+        self.write_conllu = write_conllu
+        self.files = {}
+
+    def update(self, buffer, parsed, throughput):
+        parsed = iter(parsed)
+        texts = []
+        for i, (file, _, sentences) in enumerate(buffer):
+            if file not in self.files:
+                self.files[file] = (self.statistics.new_contents(), defaultdict(list))
+                if self.write_conllu:
+                    open('out/' + file + '.conllu.part', 'wb').close()
+            if sentences is None:
+                self.finish(file)
+                print('Finished: ', file)
+                print(throughput)
+                print('-'*100)
+                continue
+            contents, index = self.files[file]
+            for sent, _ in sentences:
+                tokenlist = next(parsed)
+                self.statistics._count_tokenlist(contents, index, tokenlist, sent, EXAMPLES)
+                texts.append((sent, tokenlist))
+            throughput.update(len(sentences))
+            # conllu is written once for consecutive lines of a file in the buffer
+            if self.write_conllu and ((i + 1 == len(buffer)) or (buffer[i + 1][0] != file) or (buffer[i + 1][2] is None)):
+                with metrics.timer('write'):
+                    write_to_conllu(texts, file)
+            if not self.write_conllu or (i + 1 == len(buffer)) or (buffer[i + 1][0] != file) or (buffer[i + 1][2] is None):
+                texts = []
+
+    def finish(self, file):
+        contents, index = self.files.pop(file)
+        self.statistics.save_statistics(file + '.conllu', contents, index, texts=True)
+        if self.write_conllu:
+            os.replace('out/' + file + '.conllu.part', 'out/' + file + '.conllu')
+        metrics.emit(f'stream {file}')
+
+
+def put_all(items, output, errors):
+    '''Puts items into a queue (waiting while it is full) and None at the end or on an error.'''
+    try:
+        for item in items:
+            output.put(item)
+    except Exception as error:
+        errors.append(error)
+    finally:
+        output.put(None)
+
+def stream(files, write_conllu=False):
+    '''Streaming mode: sentences are tokenized, parsed and counted by concurrent stages connected by bounded queues
+    (at most QUEUE_SIZE buffers wait between stages, so memory does not grow with the input), and parsed sentences
+    are handed to the counting stage in memory, without serializing them to conllu and parsing them again.
+    Statistics of a file are saved when it is finished; an interrupted file is processed from the beginning next time.'''
+    Statistics.DIR_CONLLU = Statistics.DIR_JSON = 'out'
+    statistics = Statistics(offline=True)
+    for file in files:
+        if file + '.json' in statistics.json_local:
+            print('Already counted: ', file)
+    files = [file for file in files if file + '.json' not in statistics.json_local]
+    pool = start_model()
+    throughput = Throughput()
+    counting = Counting(statistics, write_conllu)
+    report = {}
+    errors = []
+    tokenized = queue.Queue(QUEUE_SIZE)
+    parsed = queue.Queue(QUEUE_SIZE)
+    threading.Thread(target=put_all, args=(iter_buffers(iter_lines(files, None, report)), tokenized, errors), daemon=True).start()
+
+    def count():
+        for buffer, tokenlists in iter(parsed.get, None):
+            if not errors:
+                try:
+                    counting.update(buffer, tokenlists, throughput)
+                except Exception as error:
+                    # the queue is still drained, so that parsing does not wait for it forever
+                    errors.append(error)
+
+    counter = threading.Thread(target=count)
+    counter.start()
+    try:
+        for buffer in iter(tokenized.get, None):
+            sentences = [tokens for _, _, sentences in buffer if sentences for _, tokens in sentences]
+            with metrics.timer('parse'):
+                tokenlists = parse_sentences(sentences, pool)
+            parsed.put((buffer, tokenlists))
+            if errors:
+                break
+    finally:
+        parsed.put(None)
+        counter.join()
+        stop_model(pool)
+    if errors:
+        raise errors[0]
+    print(throughput)
+    metrics.emit('analyzing')
+    print(metrics)
+    print_report(report)
+
+
+if __name__ == '__main__':
+    list_of_files = [file for file in os.listdir() if '.txt' in file]
+    if '--stream' in sys.argv:
+        stream(list_of_files, write_conllu='--conllu' in sys.argv)
+    else:
+        main(list_of_files)
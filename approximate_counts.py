@@ -0,0 +1,200 @@
+# Approximate counting of combinations with fixed memory for `Statistics.get_statistics(approximate=True)`.
+#
+# Most of tens of millions of distinct combinations of the corpus are seen once, so an exact Counter of them dominates memory.
+# `ApproximateCounter` keeps instead:
+#     - a count-min sketch: `depth` rows of `width` counters (int64); a key adds its count to one counter of each row
+#       (chosen by a keyed blake2b hash) and its estimate is the minimum of them,
+#     - a space-saving summary of `capacity` most frequent keys (heavy hitters) with their counts and errors.
+# Memory is about 8*width*depth bytes + ~200*capacity bytes, whatever the number of distinct keys.
+#
+# Error bounds (N is the total count of all keys):
+#     - count-min sketch never underestimates; with width = ceil(e/eps) and depth = ceil(ln(1/delta)) an estimate exceeds
+#       the true count by more than eps*N with probability at most delta (e.g. width 2**20, depth 4: eps = 2.6e-6, delta = 1.8%),
+#     - space-saving never underestimates a tracked key, overestimates it by at most its recorded error <= N/capacity,
+#       and every key with a true count > N/capacity is tracked (batches of exact counts are merged into the summary,
+#       which keeps these bounds, see Agarwal et al., "Mergeable summaries", 2012).
+# The reported count of a key is the minimum of both estimates (both are upper bounds).
+#
+# Sketches with the same width, depth and seed are merged by adding their tables, space-saving summaries are merged
+# as mergeable summaries (a key missing from a full summary is assumed to have its minimum count), so statistics of
+# shards, workers and files are joined with the same bounds for the total N.
+
+import math
+import itertools
+import hashlib
+from collections import Counter
+import numpy as np
+
+
+class CountMinSketch:
+    '''Count-min sketch of string keys (see the module description).'''
+
+    def __init__(self, width=1 << 20, depth=4, seed=0):
+        if depth > 8:
+            raise ValueError('Depth of a sketch is at most 8 (hashes of a key are taken from one blake2b digest).')
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, keys):
+        '''Returns an array (depth x number of keys) of counters of keys in each row.'''
+        salt = self.seed.to_bytes(8, 'little')
+        digests = b''.join([hashlib.blake2b(key.encode('utf-8'), digest_size=8*self.depth, salt=salt).digest() for key in keys])
+        hashes = np.frombuffer(digests, dtype=np.uint64).reshape(len(keys), self.depth).T
+        return (hashes % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, counts: dict):
+        '''Adds counts of keys.'''
+        if not counts:
+            return
+        columns = self._columns(list(counts))
+        values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], values)
+        self.total += int(values.sum())
+
+    def estimate(self, keys):
+        '''Returns estimates of counts of keys (never lower than the true counts).'''
+        if not keys:
+            return np.zeros(0, dtype=np.int64)
+        columns = self._columns(keys)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other):
+        if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError('Only sketches with the same width, depth and seed can be merged.')
+        self.table += other.table
+        self.total += other.total
+
+    def error_bounds(self):
+        '''Returns eps, delta and the absolute error eps*N of estimates.'''
+        epsilon = math.e / self.width
+        return {'epsilon': epsilon, 'delta': math.exp(-self.depth), 'max_error': epsilon * self.total}
+
+
+class SpaceSaving:
+    '''Space-saving summary of at most `capacity` most frequent keys with their counts and overestimation errors.
+    Counts are added in batches: a batch of exact counts is merged as a summary of its own.'''
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def minimum(self):
+        '''Returns the upper bound of the count of any key which is not tracked.'''
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def _merge(self, counts, errors, minimum):
+        own_minimum = self.minimum()
+        keys = list(self.counts.keys() | counts.keys())
+        merged = np.fromiter((self.counts.get(key, own_minimum) + counts.get(key, minimum) for key in keys), dtype=np.int64, count=len(keys))
+        merged_errors = np.fromiter((self.errors.get(key, own_minimum) + errors.get(key, minimum) for key in keys), dtype=np.int64, count=len(keys))
+        kept = np.argpartition(-merged, self.capacity)[:self.capacity] if len(keys) > self.capacity else np.arange(len(keys))
+        self.counts = {keys[i]: count for i, count in zip(kept.tolist(), merged[kept].tolist())}
+        self.errors = {keys[i]: error for i, error in zip(kept.tolist(), merged_errors[kept].tolist())}
+
+    def add(self, counts: dict):
+        '''Adds exact counts of keys (the same as merging them as a summary, but only new keys are looked up).'''
+        minimum = self.minimum()
+        tracked = self.counts
+        new = {}
+        for key, count in counts.items():
+            if key in tracked:
+                tracked[key] += count
+            else:
+                new[key] = minimum + count
+        if len(tracked) + len(new) <= self.capacity:
+            tracked.update(new)
+            self.errors.update(dict.fromkeys(new, minimum))
+            return
+        keys = list(tracked) + list(new)
+        values = np.fromiter(itertools.chain(tracked.values(), new.values()), dtype=np.int64, count=len(keys))
+        kept = np.argpartition(-values, self.capacity)[:self.capacity].tolist()
+        errors = self.errors
+        self.counts = {keys[i]: count for i, count in zip(kept, values[kept].tolist())}
+        self.errors = {keys[i]: errors.get(keys[i], minimum) for i in kept}
+
+    def merge(self, other):
+        '''Merges another summary: a key missing from a full summary is assumed to have its minimum count.'''
+        self._merge(other.counts, other.errors, other.minimum())
+
+
+class ApproximateCounter:
+    '''Counter-like frequencies of keys with fixed memory: a count-min sketch of all keys and a space-saving summary
+    of `capacity` most frequent ones. Updates are buffered in an exact Counter of up to `buffer` keys, which is added
+    to both structures at once. Can replace a Counter of combinations: `update`, `most_common`, `[key]`, `merge`.'''
+
+    def __init__(self, width=1 << 20, depth=4, capacity=100000, seed=0, buffer=100000):
+        self.sketch = CountMinSketch(width, depth, seed)
+        self.top = SpaceSaving(capacity)
+        self.buffer_size = buffer
+        self.buffer = Counter()
+
+    def update(self, keys):
+        '''Counts an iterable of keys or adds a mapping of counts (or merges another ApproximateCounter).'''
+        if isinstance(keys, ApproximateCounter):
+            return self.merge(keys)
+        self.buffer.update(keys)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.sketch.add(self.buffer)
+        self.top.add(self.buffer)
+        self.buffer = Counter()
+
+    def merge(self, other):
+        self.flush()
+        other.flush()
+        self.sketch.merge(other.sketch)
+        self.top.merge(other.top)
+
+    def __getitem__(self, key):
+        self.flush()
+        estimate = int(self.sketch.estimate([key])[0])
+        return min(estimate, self.top.counts[key]) if key in self.top.counts else estimate
+
+    def most_common(self, n=None):
+        '''Returns up to `n` (by default `capacity`) most frequent keys with their estimated counts.'''
+        self.flush()
+        keys = list(self.top.counts)
+        estimates = np.minimum(self.sketch.estimate(keys), np.fromiter(self.top.counts.values(), dtype=np.int64, count=len(keys)))
+        order = np.lexsort((np.arange(len(keys)), -estimates))[:n]
+        return [(keys[i], int(estimates[i])) for i in order]
+
+    def error_bounds(self):
+        '''Returns error bounds of estimates (see the module description).'''
+        self.flush()
+        bounds = self.sketch.error_bounds()
+        bounds.update({'total': self.sketch.total, 'capacity': self.top.capacity, 'max_top_error': self.top.minimum()})
+        return bounds
+
+    def save(self, path):
+        '''Saves the sketch and the summary to an uncompressed npz-file.'''
+        self.flush()
+        keys = list(self.top.counts)
+        # keys are concatenated utf-8 strings with offsets (as in `binary_statistics`), so one long key does not widen all of them
+        encoded = [key.encode('utf-8') for key in keys]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(key) for key in encoded], out=offsets[1:])
+        np.savez(path, table=self.sketch.table,
+            parameters=np.array([self.sketch.width, self.sketch.depth, self.sketch.seed, self.sketch.total, self.top.capacity], dtype=np.int64),
+            strings=np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets=offsets,
+            counts=np.array([self.top.counts[key] for key in keys], dtype=np.int64),
+            errors=np.array([self.top.errors[key] for key in keys], dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            width, depth, seed, total, capacity = data['parameters'].tolist()
+            counter = cls(width, depth, capacity, seed)
+            counter.sketch.table = data['table']
+            counter.sketch.total = total
+            strings, offsets = data['strings'].tobytes(), data['offsets'].tolist()
+            keys = [strings[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+            counter.top.counts = dict(zip(keys, data['counts'].tolist()))
+            counter.top.errors = dict(zip(keys, data['errors'].tolist()))
+        return counter
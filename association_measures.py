@@ -0,0 +1,155 @@
+# Association measures of verbs and their collocates (prepositions with nouns or only nouns) computed from combinations
+# of statistics collected by `Statistics.get_statistics` / `Statistics.join_statistics`.
+#
+# For a pair (verb, collocate) with frequency O11, verb frequency R1, collocate frequency C1 and sample size N
+# the expected frequency is E11 = R1*C1/N, and the measures are:
+#     pmi            = log2(O11/E11)
+#     t_score        = (O11 - E11)/sqrt(O11)
+#     z_score        = (O11 - E11)/sqrt(E11)
+#     log_likelihood = 2*sum(Oij*ln(Oij/Eij)) over the 2x2 contingency table
+#     dice           = 2*O11/(R1 + C1)
+#     log_dice       = 14 + log2(dice)
+# By default R1, C1 and N are marginals of the combinations themselves; with `corpus_marginals=True` (only for noun collocates)
+# they are counts of verbs and nouns in the corpus and the number of words.
+#
+# usage:
+# python3 association_measures.py statistics.json measure [top] [verb ...]
+
+import sys
+import json
+import numpy as np
+from combinations_store import CombinationsStore
+
+
+def _ll_term(observed, expected):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(observed > 0, observed * np.log(observed / expected), 0.0)
+
+
+class Associations:
+    '''Frequencies of (verb, collocate) pairs with marginal arrays, sorted by verb codes.
+    All measures are computed for all pairs at once (`scores`), top collocates of a verb are selected with argpartition (`top`).'''
+
+    MEASURES = ['pmi', 't_score', 'z_score', 'log_likelihood', 'dice', 'log_dice']
+
+    def __init__(self, verbs, collocates, pair_verbs, pair_collocates, counts, verb_counts, collocate_counts, total):
+        self.verbs = verbs
+        self.collocates = collocates
+        self.pair_verbs = pair_verbs
+        self.pair_collocates = pair_collocates
+        self.counts = counts
+        self.verb_counts = verb_counts
+        self.collocate_counts = collocate_counts
+        self.total = total
+        # pairs of the i-th verb are verb_starts[i]:verb_starts[i+1]
+        self.verb_starts = np.searchsorted(pair_verbs, np.arange(len(verbs) + 1))
+        self._verb_index = None
+        self._scores = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    @classmethod
+    def from_store(cls, store: CombinationsStore, collocate=('prep', 'noun'), statistics=None):
+        '''Aggregates combinations of a store into (verb, collocate) pairs; `collocate` is a tuple of fields of a store.
+        If `statistics` (with `verbs`, `nouns` and `words`) is given, marginals are taken from the corpus counts
+        (possible only for `collocate=('noun',)`).'''
+        fields = [CombinationsStore.FIELDS.index(field) for field in collocate]
+        shape = tuple(len(store.vocabularies[i]) for i in fields)
+        keys = np.ravel_multi_index(tuple(store.codes[:, i].astype(np.int64) for i in fields), shape) if len(store) else np.zeros(0, dtype=np.int64)
+        collocate_keys, collocate_codes = np.unique(keys, return_inverse=True)
+        pairs, inverse = np.unique(store.codes[:, 0].astype(np.int64) * len(collocate_keys) + collocate_codes, return_inverse=True)
+        counts = np.bincount(inverse, weights=store.counts, minlength=len(pairs))
+        pair_verbs, pair_collocates = pairs // max(len(collocate_keys), 1), pairs % max(len(collocate_keys), 1)
+        collocates = np.array(['__'.join(values) for values in zip(*[
+            store.vocabularies[i][codes].tolist() for i, codes in zip(fields, np.unravel_index(collocate_keys, shape))
+        ])], dtype=str)
+        verbs = store.vocabularies[0]
+        verb_counts = np.bincount(pair_verbs, weights=counts, minlength=len(verbs))
+        collocate_counts = np.bincount(pair_collocates, weights=counts, minlength=len(collocates))
+        total = counts.sum()
+        if statistics is not None:
+            if tuple(collocate) != ('noun',):
+                raise ValueError('Corpus marginals are defined only for noun collocates.')
+            # lemmas of combinations are not lowercased, unlike keys of `verbs` and `nouns`
+            verb_counts = np.maximum(verb_counts, [statistics['verbs'].get(verb.lower(), 0) for verb in verbs.tolist()])
+            collocate_counts = np.maximum(collocate_counts, [statistics['nouns'].get(noun.lower(), 0) for noun in collocates.tolist()])
+            total = max(total, statistics['words'])
+        return cls(verbs, collocates, pair_verbs, pair_collocates, counts, verb_counts, collocate_counts, total)
+
+    @classmethod
+    def from_statistics(cls, statistics, collocate=('prep', 'noun'), corpus_marginals=False, category='combinations'):
+        '''Builds pairs from statistics (a dictionary as saved to json-file or `BinaryStatistics`).'''
+        store = CombinationsStore.from_dict(statistics[category])
+        return cls.from_store(store, collocate, statistics if corpus_marginals else None)
+
+    @classmethod
+    def from_json(cls, json_path, collocate=('prep', 'noun'), corpus_marginals=False, category='combinations'):
+        with open(json_path, encoding='utf-8') as file:
+            return cls.from_statistics(json.load(file), collocate, corpus_marginals, category)
+
+    def scores(self, measures=None):
+        '''Returns a dictionary of arrays of measures (all by default) for all pairs. Computed arrays are cached.'''
+        measures = measures or self.MEASURES
+        unknown = [measure for measure in measures if measure not in self.MEASURES]
+        if unknown:
+            raise ValueError(f'Unknown measures {unknown}. Measures are: {self.MEASURES}.')
+        missing = [measure for measure in measures if measure not in self._scores]
+        if missing:
+            o11 = self.counts
+            r1 = self.verb_counts[self.pair_verbs]
+            c1 = self.collocate_counts[self.pair_collocates]
+            n = float(self.total)
+            e11 = r1 * c1 / n
+            for measure in missing:
+                if measure == 'pmi':
+                    score = np.log2(o11 / e11)
+                elif measure == 't_score':
+                    score = (o11 - e11) / np.sqrt(o11)
+                elif measure == 'z_score':
+                    score = (o11 - e11) / np.sqrt(e11)
+                elif measure == 'log_likelihood':
+                    r2, c2 = n - r1, n - c1
+                    score = 2 * (_ll_term(o11, e11) + _ll_term(r1 - o11, r1 * c2 / n) + \
+                        _ll_term(c1 - o11, r2 * c1 / n) + _ll_term(n - r1 - c1 + o11, r2 * c2 / n))
+                elif measure == 'dice':
+                    score = 2 * o11 / (r1 + c1)
+                elif measure == 'log_dice':
+                    score = 14 + np.log2(2 * o11 / (r1 + c1))
+                self._scores[measure] = score
+        return {measure: self._scores[measure] for measure in measures}
+
+    def score(self, measure):
+        return self.scores([measure])[measure]
+
+    def _verb_code(self, verb):
+        if self._verb_index is None:
+            self._verb_index = {value: code for code, value in enumerate(self.verbs.tolist())}
+        return self._verb_index.get(verb)
+
+    def _top(self, code, score, top, min_count):
+        start, end = self.verb_starts[code], self.verb_starts[code+1]
+        candidates = start + np.flatnonzero(self.counts[start:end] >= min_count)
+        if (top is not None) and (top < len(candidates)):
+            candidates = candidates[np.argpartition(-score[candidates], top)[:top]]
+        candidates = candidates[np.lexsort((candidates, -score[candidates]))]
+        return [(str(self.collocates[self.pair_collocates[i]]), float(score[i]), int(self.counts[i])) for i in candidates]
+
+    def top(self, measure, verb=None, top=10, min_count=1):
+        '''Returns `top` collocates of a verb by a measure as a list of (collocate, score, frequency);
+        if `verb` is None, returns a dictionary of such lists for all verbs. Pairs rarer than `min_count` are skipped.'''
+        score = self.score(measure)
+        if verb is not None:
+            code = self._verb_code(verb)
+            return [] if code is None else self._top(code, score, top, min_count)
+        return {verb: self._top(code, score, top, min_count) for code, verb in enumerate(self.verbs.tolist())}
+
+
+if __name__ == '__main__':
+    associations = Associations.from_json(sys.argv[1])
+    measure = sys.argv[2]
+    top = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    for verb in (sys.argv[4:] or associations.verbs.tolist()):
+        print(verb)
+        for collocate, score, count in associations.top(measure, verb, top):
+            print(f'\t{collocate}\t{score:.3f}\t{count}')
@@ -0,0 +1,58 @@
+# Compares the single-pass extraction engine (`Statistics._extract_all`) with the
+# per-method extraction (`_extract_verbs`, `_extract_nouns`, `_extract_prepositions`, `_extract_combinations`)
+# on a sample conllu-file and checks that both produce identical statistics.
+#
+# usage:
+# python3 benchmark_extraction.py sample.conllu [repeats]
+
+import os
+import sys
+import time
+import json
+from collections import Counter
+from extracting_verb_model import Statistics
+
+
+def load_statistics(conllu_path):
+    '''Returns a Statistics object without a Minio connection and tokenlists of a given conllu-file.'''
+    Statistics.DIR_CONLLU = os.path.dirname(os.path.abspath(conllu_path))
+    stats = Statistics.__new__(Statistics)
+    try:
+        with open('prepositional_government.json', encoding='utf-8') as file:
+            stats.prepositional_government = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        stats.prepositional_government = {}
+    return stats, stats.get_tokenlists_from_conllu(os.path.basename(conllu_path))
+
+def extract_by_methods(stats, tokenlist):
+    verbs = stats._extract_verbs(tokenlist)
+    nouns, case, number, animacy, relation = stats._extract_nouns(tokenlist)
+    prepositions = stats._extract_prepositions(tokenlist)
+    combinations, filtered = stats._extract_combinations(tokenlist)
+    return verbs, nouns, case, number, animacy, relation, prepositions, combinations, filtered
+
+def run(extract, stats, tokenlists, repeats):
+    '''Returns the best time of `repeats` runs and counters collected by the last run.'''
+    best = None
+    for _ in range(repeats):
+        counters = [Counter() for _ in range(9)]
+        start = time.perf_counter()
+        for tokenlist in tokenlists:
+            for counter, items in zip(counters, extract(stats, tokenlist)):
+                counter.update(items)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, [list(counter.most_common()) for counter in counters]
+
+
+if __name__ == '__main__':
+    conllu_path = sys.argv[1]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    stats, tokenlists = load_statistics(conllu_path)
+    print(f'Sentences: {len(tokenlists)}, repeats: {repeats}')
+    methods_time, methods_result = run(extract_by_methods, stats, tokenlists, repeats)
+    single_time, single_result = run(Statistics._extract_all, stats, tokenlists, repeats)
+    print(f'_extract_* methods: {methods_time:.3f} s ({len(tokenlists)/methods_time:.1f} sentences/s)')
+    print(f'_extract_all:       {single_time:.3f} s ({len(tokenlists)/single_time:.1f} sentences/s)')
+    print(f'Speedup: {methods_time/single_time:.2f}x')
+    print('Identical output:', methods_result == single_result)
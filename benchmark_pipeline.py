@@ -0,0 +1,130 @@
+# Benchmark of the statistics pipeline on synthetic corpora of several sizes, which runs offline:
+# conllu-files are generated by `synthetic_corpus` and "downloaded" from a local bucket through `local_storage.LocalMinio`.
+#
+# For each size (number of sentences in a file) the steps are
+#     download_many, get_statistics (of each file), get_statistics with WORKERS processes, join_statistics,
+#     join_statistics (external merge), filter_combinations, find_text
+# and each step is run in a fresh process, which reports its time, sentences per second (where it makes sense)
+# and peak RSS growth. Results are printed and appended to `benchmark_pipeline.jsonl` with the git commit and a timestamp,
+# so that regressions and speedups can be tracked over time.
+#
+# usage (from the repository directory):
+# python3 benchmark_pipeline.py [sentences ...]
+
+import os
+import sys
+import json
+import time
+import tempfile
+import resource
+import subprocess
+import multiprocessing
+from local_storage import LocalMinio
+from synthetic_corpus import write_bucket
+from extracting_verb_model import Statistics
+
+
+FILES = 2
+WORKERS = 4
+FIND_TEXT_COMBINATIONS = 20
+RESULTS = 'benchmark_pipeline.jsonl'
+
+
+def make_statistics(root):
+    Statistics.DIR_CONLLU = os.path.join(root, 'conllu')
+    Statistics.DIR_JSON = os.path.join(root, 'json')
+    return Statistics(minio_client=LocalMinio(os.path.join(root, 'bucket')))
+
+def step_download(stats, files):
+    stats.download_many(files)
+    return None
+
+def step_statistics(stats, files):
+    for file in files[:-1]:
+        stats.get_statistics(file)
+    return sum([stats.read_statistics(file[:-7]+'.json')['sentences'] for file in files[:-1]])
+
+def step_statistics_workers(stats, files):
+    stats.get_statistics(files[-1], workers=WORKERS)
+    return stats.read_statistics(files[-1][:-7]+'.json')['sentences']
+
+def step_join(stats, files):
+    return stats.join_statistics(files)['sentences']
+
+def step_join_external(stats, files):
+    stats.join_statistics(files, save_to='joined_external', external=True)
+    return None
+
+def step_filter(stats, files):
+    combinations = stats.read_statistics('joined_external.json')['combinations']
+    verb = max(combinations, key=combinations.get).split('__')[0]
+    stats.filter_combinations(combinations, verb=verb)
+    stats.filter_combinations(combinations, prep='в', case='Loc')
+    return None
+
+def step_find_text(stats, files):
+    combinations = stats.read_statistics('joined_external.json')['combinations']
+    keys = sorted(combinations, key=combinations.get, reverse=True)[:FIND_TEXT_COMBINATIONS]
+    stats.find_text({key: combinations[key] for key in keys}, files)
+    return None
+
+STEPS = [
+    ('download_many', step_download),
+    ('get_statistics', step_statistics),
+    (f'get_statistics (workers={WORKERS})', step_statistics_workers),
+    ('join_statistics', step_join),
+    ('join_statistics (external)', step_join_external),
+    ('filter_combinations', step_filter),
+    ('find_text', step_find_text)
+]
+
+def measure(step, root, files, queue):
+    stats = make_statistics(root)
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    try:
+        sentences = step(stats, files)
+    except Exception as error:
+        queue.put(error)
+        raise
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, sentences, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024))
+
+def run(step, root, files):
+    '''Runs a step in a fresh process. Returns its time, number of processed sentences (or None) and peak RSS growth (MB).'''
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=measure, args=(step, root, files, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 10000, 50000]
+    record = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(), 'files': FILES, 'results': []}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as root:
+            start = time.perf_counter()
+            files = write_bucket(os.path.join(root, 'bucket'), FILES, size)
+            print(f'Sentences per file: {size}, files: {len(files)} (generated in {time.perf_counter() - start:.1f} s)')
+            os.makedirs(os.path.join(root, 'conllu'))
+            os.makedirs(os.path.join(root, 'json'))
+            for name, step in STEPS:
+                elapsed, sentences, rss = run(step, root, files)
+                speed = f'{sentences/elapsed:10.0f} sentences/s' if sentences else ' '*23
+                print(f'    {name:30} {elapsed:8.3f} s {speed}  peak RSS growth: {rss:7.1f} MB')
+                record['results'].append({'sentences': size, 'step': name, 'seconds': elapsed, 'sentences_per_second': sentences/elapsed if sentences else None, 'rss_mb': rss})
+    with open(RESULTS, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record) + '\n')
+    print('Results are appended to', RESULTS)
@@ -0,0 +1,134 @@
+# Load test of `query_service`: the service runs in a separate process, CLIENTS threads send a mix of filter, top and examples
+# queries over HTTP for DURATION seconds and queries per second and latency percentiles (measured by clients) are reported, first without the cache of results
+# and then with it, followed by latencies of each query type measured by the service.
+# Queries are drawn from QUERIES distinct ones with Zipf-distributed frequencies (frequent verbs are asked about more often).
+#
+# It runs offline: without arguments a synthetic corpus is generated (see `synthetic_corpus`) and its statistics are counted.
+#
+# usage:
+# python3 benchmark_query_service.py [statistics.json [conllu_dir [index_dir]]]
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import threading
+import http.client
+import multiprocessing
+from urllib.parse import urlencode
+import numpy as np
+from synthetic_corpus import SyntheticCorpus, zipf
+from extracting_verb_model import Statistics
+from query_service import QueryService, serve
+
+
+CLIENTS = 8
+DURATION = 10
+QUERIES = 2000
+SENTENCES = 20000
+
+
+def make_corpus(root):
+    '''Writes a synthetic conllu-file and counts its statistics. Returns paths of the statistics json-file, of conllu directory
+    and of the directory of indices.'''
+    os.makedirs(os.path.join(root, 'conllu'))
+    os.makedirs(os.path.join(root, 'json'))
+    SyntheticCorpus().write(os.path.join(root, 'conllu', 'synthetic.conllu'), SENTENCES)
+    Statistics.DIR_CONLLU = os.path.join(root, 'conllu')
+    Statistics.DIR_JSON = os.path.join(root, 'json')
+    Statistics(offline=True, compact=True).get_statistics('synthetic.conllu', examples=10)
+    return os.path.join(root, 'json', 'synthetic.json'), os.path.join(root, 'conllu'), os.path.join(root, 'json')
+
+def make_queries(service, seed=0):
+    '''Returns URLs of QUERIES distinct queries about the most frequent verbs and combinations (the most frequent first).'''
+    rng = random.Random(seed)
+    verbs = [verb for verb, _ in service.index.verbs(top=QUERIES)]
+    combinations = [key for key, _ in service.filter(top=QUERIES)['combinations']]
+    queries = []
+    for i in range(QUERIES * 4):
+        verb = verbs[i % len(verbs)]
+        kind = rng.choice(['filter', 'filter', 'top', 'top'] + (['examples'] if service.indexed else []))
+        if kind == 'filter':
+            parameters = {'verb': verb}
+            prepositions = service.index.prepositions(verb, top=3)
+            if prepositions and rng.random() < 0.5:
+                parameters['prep'] = rng.choice(prepositions)[0]
+            if rng.random() < 0.3:
+                parameters['not_case'] = 'Gen'
+        elif kind == 'top':
+            parameters = {'verb': verb}
+            prepositions = service.index.prepositions(verb, top=3)
+            if prepositions and rng.random() < 0.5:
+                parameters['prep'] = rng.choice(prepositions)[0]
+        else:
+            parameters = {'combination': combinations[i % len(combinations)], 'limit': 5}
+        queries.append(f'/{kind}?' + urlencode(parameters))
+    return list(dict.fromkeys(queries))[:QUERIES]
+
+def run_server(json_path, conllu_dir, index_dir, cache_size, ports):
+    service = QueryService(json_path, conllu_dir, index_dir, cache_size)
+    server = serve(service, 0, quiet=True)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+def get_stats(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    connection.request('GET', '/stats')
+    stats = json.loads(connection.getresponse().read())
+    connection.close()
+    return stats
+
+def client(port, queries, weights, deadline, latencies, errors, seed):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    while time.perf_counter() < deadline:
+        query = rng.choices(queries, cum_weights=weights)[0]
+        start = time.perf_counter()
+        connection.request('GET', query)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(query)
+    connection.close()
+
+def load_test(port, queries):
+    '''Runs CLIENTS clients for DURATION seconds. Returns queries per second, latencies (ms) and failed queries.'''
+    weights = zipf(len(queries))
+    latencies, errors = [], []
+    deadline = time.perf_counter() + DURATION
+    clients = [threading.Thread(target=client, args=(port, queries, weights, deadline, latencies, errors, i)) for i in range(CLIENTS)]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - start), np.array(latencies) * 1000, errors
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as root:
+        if len(sys.argv) > 1:
+            json_path, conllu_dir, index_dir = sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None, sys.argv[3] if len(sys.argv) > 3 else None
+        else:
+            print(f'Generating a synthetic corpus of {SENTENCES} sentences...')
+            json_path, conllu_dir, index_dir = make_corpus(root)
+        service = QueryService(json_path, conllu_dir, index_dir)
+        queries = make_queries(service)
+        service.close()
+        print(f'{len(queries)} distinct queries, {CLIENTS} clients, {DURATION} s')
+        for name, cache_size in [('without cache', 0), ('with cache', service.cache_size)]:
+            ports = multiprocessing.Queue()
+            server = multiprocessing.Process(target=run_server, args=(json_path, conllu_dir, index_dir, cache_size, ports), daemon=True)
+            server.start()
+            port = ports.get()
+            qps, latencies, errors = load_test(port, queries)
+            print(f'{name}: {qps:.1f} queries/s, latency p50 {np.percentile(latencies, 50):.2f} ms, ' + \
+                f'p95 {np.percentile(latencies, 95):.2f} ms, p99 {np.percentile(latencies, 99):.2f} ms, failed: {len(errors)}')
+            for query, stats in get_stats(port).items():
+                print(f'    {query:10} {stats["queries"]:8} queries, cache hits {stats["cache_hits"]:8}, ' + \
+                    f'service latency p50 {stats["p50_ms"]:.3f} ms, p99 {stats["p99_ms"]:.3f} ms')
+            server.terminate()
+            server.join()
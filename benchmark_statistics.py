@@ -0,0 +1,51 @@
+# Compares loading statistics from a json-file (`json.load`) with opening a binary statistics file through mmap:
+# load time, time of looking up random combinations and peak RSS of a fresh process.
+#
+# usage:
+# python3 benchmark_statistics.py statistics.json [lookups]
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+import multiprocessing
+from binary_statistics import convert_json, BinaryStatistics
+
+
+def load_json(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+def measure(load, path, keys, queue):
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    statistics = load(path)
+    loaded = time.perf_counter()
+    found = sum([1 for key in keys if key in statistics['combinations']])
+    looked_up = time.perf_counter()
+    queue.put((loaded - start, looked_up - loaded, found, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024))
+
+def run(load, path, keys):
+    '''Runs `measure` in a fresh process. Returns load time, lookup time, number of found keys and peak RSS growth (MB).'''
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=measure, args=(load, path, keys, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == '__main__':
+    json_path = sys.argv[1]
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    stats_path = json_path[:-5]+'.stats'
+    if not os.path.exists(stats_path):
+        convert_json(json_path, stats_path)
+    keys = random.sample(list(load_json(json_path)['combinations']), lookups)
+    print(f'json: {os.path.getsize(json_path)/2**20:.1f} MB, stats: {os.path.getsize(stats_path)/2**20:.1f} MB, lookups: {len(keys)}')
+    for name, load, path in [('json.load', load_json, json_path), ('mmap', BinaryStatistics, stats_path)]:
+        load_time, lookup_time, found, rss = run(load, path, keys)
+        print(f'{name:10} load: {load_time:.4f} s, lookups: {lookup_time:.4f} s (found {found}), peak RSS growth: {rss:.1f} MB')
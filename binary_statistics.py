@@ -0,0 +1,202 @@
+# Binary format of statistics collected by `Statistics.get_statistics`.
+#
+# file layout:
+# MAGIC | for each category: strings | offsets (uint64) | counts (int64) | order (uint64) | header (json) | header size (uint64)
+#
+# strings of a category are utf-8 encoded keys sorted bytewise (so a key is found by binary search),
+# offsets[i]:offsets[i+1] are bounds of the i-th key in strings, counts[i] is its frequency,
+# order lists indices of keys in the order of json-file (by descending frequency).
+# The file is opened through mmap and only accessed keys are decoded.
+#
+# Files sorted by keys are also runs of a k-way merge (`merge_binary_statistics`), which joins statistics of many files
+# with memory bounded by the number of files.
+#
+# usage (converting json-files):
+# python3 binary_statistics.py statistics.json [statistics.json ...]
+
+import sys
+import json
+import mmap
+import itertools
+import heapq
+import operator
+from collections.abc import Mapping
+import numpy as np
+
+
+MAGIC = b'VCCSTAT1'
+CATEGORIES = ['verbs', 'nouns', 'case', 'number', 'animacy', 'relation', 'prepositions', 'combinations', 'filtered']
+
+
+def write_binary_statistics(statistics, path):
+    '''Writes statistics (a dictionary as saved to json-file) to a binary file.'''
+    header = {'sentences': statistics['sentences'], 'words': statistics['words'], 'categories': {}}
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        for category in CATEGORIES:
+            keys = [key.encode('utf-8') for key in statistics[category]]
+            counts = np.fromiter(statistics[category].values(), dtype=np.int64, count=len(keys))
+            sorted_order = sorted(range(len(keys)), key=keys.__getitem__)
+            offsets = np.zeros(len(keys) + 1, dtype=np.uint64)
+            np.cumsum([len(keys[i]) for i in sorted_order], out=offsets[1:])
+            strings = b''.join([keys[i] for i in sorted_order])
+            position = file.tell()
+            file.write(strings)
+            file.write(b'\0' * (-file.tell() % 8))
+            sections = {'n': len(keys), 'strings': position}
+            for name, array in [('offsets', offsets), ('counts', counts[sorted_order]), ('order', np.argsort(sorted_order).astype(np.uint64))]:
+                sections[name] = file.tell()
+                file.write(array.tobytes())
+            header['categories'][category] = sections
+        header = json.dumps(header).encode('utf-8')
+        file.write(header)
+        file.write(np.uint64(len(header)).tobytes())
+
+def convert_json(json_path, path=None):
+    '''Converts json-file with statistics to a binary file (`<name>.stats` by default).'''
+    with open(json_path, encoding='utf-8') as file:
+        statistics = json.load(file)
+    path = path or json_path[:-5]+'.stats'
+    write_binary_statistics(statistics, path)
+    return path
+
+
+class BinaryCounter(Mapping):
+    '''Read-only frequency dictionary of a category stored in a binary statistics file.
+    Iterates keys in the order of json-file (by descending frequency).'''
+
+    def __init__(self, buffer, n, strings, offsets, counts, order):
+        self.buffer = buffer
+        self.n = n
+        self.strings = strings
+        self.offsets = np.frombuffer(buffer, dtype=np.uint64, count=n+1, offset=offsets)
+        self.counts = np.frombuffer(buffer, dtype=np.int64, count=n, offset=counts)
+        self.order = np.frombuffer(buffer, dtype=np.uint64, count=n, offset=order)
+
+    def _key(self, i):
+        return self.buffer[self.strings+int(self.offsets[i]):self.strings+int(self.offsets[i+1])]
+
+    def _find(self, key):
+        key = key.encode('utf-8')
+        low, high = 0, self.n
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if (low < self.n) and (self._key(low) == key):
+            return low
+        return None
+
+    def __getitem__(self, key):
+        i = self._find(key) if isinstance(key, str) else None
+        if i is None:
+            raise KeyError(key)
+        return int(self.counts[i])
+
+    def __contains__(self, key):
+        return isinstance(key, str) and (self._find(key) is not None)
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        for i in self.order:
+            yield self._key(i).decode('utf-8')
+
+    def items(self):
+        for i in self.order:
+            yield self._key(i).decode('utf-8'), int(self.counts[i])
+
+    def values(self):
+        for i in self.order:
+            yield int(self.counts[i])
+
+    def most_common(self, n=None):
+        return list(itertools.islice(self.items(), n))
+
+    def sorted_items(self):
+        '''Yields utf-8 encoded keys with their counts in bytewise order of keys.'''
+        for i in range(self.n):
+            yield self._key(i), int(self.counts[i])
+
+    def _release(self):
+        '''Drops numpy views of the mapped file (when it is closed), the counter is empty afterwards.'''
+        self.n = 0
+        self.offsets = np.zeros(1, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.order = np.zeros(0, dtype=np.uint64)
+
+
+class BinaryStatistics(Mapping):
+    '''Statistics from a binary file opened through mmap: `sentences` and `words` counts and `BinaryCounter` of each category.'''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'File `{path}` is not a binary statistics file.')
+        header_size = int(np.frombuffer(self.buffer, dtype=np.uint64, count=1, offset=len(self.buffer)-8)[0])
+        header = json.loads(self.buffer[len(self.buffer)-8-header_size:len(self.buffer)-8])
+        self.contents = {'sentences': header['sentences'], 'words': header['words']}
+        for category, sections in header['categories'].items():
+            self.contents[category] = BinaryCounter(self.buffer, **sections)
+
+    def __getitem__(self, key):
+        return self.contents[key]
+
+    def __len__(self):
+        return len(self.contents)
+
+    def __iter__(self):
+        return iter(self.contents)
+
+    def close(self):
+        '''Closes the file. Counters handed out by the object are emptied, so they do not keep views of the mapped file;
+        if a view is still held elsewhere (e.g. by an unfinished iteration), the file is unmapped when it is released.'''
+        for counter in self.contents.values():
+            if isinstance(counter, BinaryCounter):
+                counter._release()
+        self.contents = {}
+        try:
+            self.buffer.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+
+def merge_counters(counters):
+    '''Merges key-sorted runs of `BinaryCounter`s with a heap. Yields utf-8 encoded keys with summed counts in bytewise order of keys.'''
+    merged = heapq.merge(*[counter.sorted_items() for counter in counters], key=operator.itemgetter(0))
+    for key, group in itertools.groupby(merged, key=operator.itemgetter(0)):
+        yield key, sum([count for _, count in group])
+
+def merge_binary_statistics(paths, json_path, top=None, sort=False):
+    '''Joins binary statistics files with a k-way merge and writes the result to json-file
+    without keeping joined frequency dictionaries in memory.
+    Keys of each category are written in bytewise order; if `top` is given, only `top` most frequent keys are kept
+    and sorted by frequency; if `sort` is True, all keys are sorted by frequency (in memory).'''
+    statistics = [BinaryStatistics(path) for path in paths]
+    try:
+        with open(json_path, 'w', encoding='utf-8') as file:
+            file.write('{"sentences": %d, "words": %d' % (sum([stat['sentences'] for stat in statistics]), sum([stat['words'] for stat in statistics])))
+            for category in CATEGORIES:
+                items = merge_counters([stat[category] for stat in statistics])
+                if top is not None:
+                    items = heapq.nlargest(top, items, key=operator.itemgetter(1))
+                elif sort:
+                    items = sorted(items, key=operator.itemgetter(1), reverse=True)
+                file.write(', %s: {' % json.dumps(category))
+                for i, (key, count) in enumerate(items):
+                    file.write('%s%s: %d' % (', ' if i else '', json.dumps(key.decode('utf-8'), ensure_ascii=False), count))
+                file.write('}')
+            file.write('}')
+    finally:
+        for stat in statistics:
+            stat.close()
+
+
+if __name__ == '__main__':
+    for json_path in sys.argv[1:]:
+        print('Saved:', convert_json(json_path))
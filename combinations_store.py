@@ -0,0 +1,95 @@
+import json
+from array import array
+import numpy as np
+
+
+class CombinationsStore:
+    '''Columnar storage of combinations `verblemma__preposition__nounlemma__nouncase__nounnumber__nounanimacy__noundeprel`.
+    Each of the seven fields is dictionary-encoded: `codes[:, i]` are indices in the sorted vocabulary `vocabularies[i]`,
+    `counts` are frequencies of combinations.'''
+
+    FIELDS = ['verb', 'prep', 'noun', 'case', 'num', 'anim', 'rel']
+
+    def __init__(self, vocabularies, codes, counts):
+        self.vocabularies = vocabularies
+        self.codes = codes
+        self.counts = counts
+        self._indices = [None] * len(self.FIELDS)
+
+    def __len__(self):
+        return len(self.counts)
+
+    @classmethod
+    def from_dict(cls, combinations: dict):
+        '''Encodes a frequency dictionary of combinations (e.g. `combinations` or `filtered` from statistics json-file).'''
+        # values of each field get codes in order of appearance (a dictionary per field, so that no array of all strings
+        # is built), then vocabularies are sorted and codes are renumbered
+        ids = [{} for _ in cls.FIELDS]
+        flat = array('i')
+        for key in combinations:
+            field = key.split('__')
+            if len(field) != len(cls.FIELDS):
+                raise ValueError(f'Combination `{key}` does not consist of {len(cls.FIELDS)} fields.')
+            flat.extend([field_ids.setdefault(value, len(field_ids)) for field_ids, value in zip(ids, field)])
+        codes = np.frombuffer(flat, dtype=np.int32).reshape(-1, len(cls.FIELDS)).copy()
+        vocabularies = []
+        for i, field_ids in enumerate(ids):
+            vocabulary = np.array(list(field_ids), dtype=str)
+            order = np.argsort(vocabulary, kind='stable')
+            renumbered = np.empty(len(order), dtype=np.int32)
+            renumbered[order] = np.arange(len(order), dtype=np.int32)
+            codes[:, i] = renumbered[codes[:, i]]
+            vocabularies.append(vocabulary[order])
+        counts = np.fromiter(combinations.values(), dtype=np.int64, count=len(combinations))
+        return cls(vocabularies, codes, counts)
+
+    @classmethod
+    def from_json(cls, json_path, category='combinations'):
+        '''Loads combinations from a statistics json-file (`combinations` or `filtered`).'''
+        with open(json_path, encoding='utf-8') as file:
+            return cls.from_dict(json.load(file)[category])
+
+    def to_dict(self):
+        '''Returns a frequency dictionary of combinations in the stored order.'''
+        fields = [vocabulary[self.codes[:, i]] for i, vocabulary in enumerate(self.vocabularies)]
+        return {'__'.join(field): int(count) for *field, count in zip(*fields, self.counts)}
+
+    def save(self, npz_path):
+        '''Saves arrays to an uncompressed npz-file.'''
+        np.savez(npz_path, codes=self.codes, counts=self.counts,
+            **{'vocabulary_'+field: vocabulary for field, vocabulary in zip(self.FIELDS, self.vocabularies)})
+
+    @classmethod
+    def load(cls, npz_path):
+        '''Loads arrays saved by `save`.'''
+        with np.load(npz_path) as data:
+            return cls([data['vocabulary_'+field] for field in cls.FIELDS], data['codes'], data['counts'])
+
+    def _index(self, i):
+        if self._indices[i] is None:
+            self._indices[i] = {value: code for code, value in enumerate(self.vocabularies[i].tolist())}
+        return self._indices[i]
+
+    def mask(self, **criteria):
+        '''Returns a boolean mask of combinations which match all criteria.
+        A criterion is a field name (`verb`, `prep`, `noun`, `case`, `num`, `anim`, `rel`) with a value or a list of values;
+        `not_` prefix negates it, e.g. mask(verb='делать', prep=['в', 'на'], not_case='Gen').'''
+        mask = np.ones(len(self), dtype=bool)
+        for name, value in criteria.items():
+            negate = name.startswith('not_')
+            field = name[4:] if negate else name
+            if field not in self.FIELDS:
+                raise TypeError(f'Unknown field `{field}`. Fields are: {self.FIELDS}.')
+            i = self.FIELDS.index(field)
+            index = self._index(i)
+            values = [value] if isinstance(value, str) else value
+            matches = np.isin(self.codes[:, i], [index[value] for value in values if value in index])
+            mask &= ~matches if negate else matches
+        return mask
+
+    def filter(self, **criteria):
+        '''Returns a store of combinations which match all criteria (see `mask`).'''
+        mask = self.mask(**criteria)
+        store = CombinationsStore(self.vocabularies, self.codes[mask], self.counts[mask])
+        store._indices = self._indices
+        return store
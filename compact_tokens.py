@@ -0,0 +1,190 @@
+# Compact representation of parsed sentences for `Statistics(compact=True)`.
+#
+# A conllu TokenList keeps every token as a dictionary of strings with a nested dictionary of features, and extraction
+# looks them up again and again (`token['upos']`, `token['feats']['Case']`, `.lower()`). A `CompactSentence` instead keeps
+# parallel arrays of integer ids of interned strings (form, lemma, upos, deprel, Case, Number, Animacy) and of head positions,
+# so a sentence takes a few arrays of 4-byte ints, strings are shared by all sentences and lowercase variants are computed once.
+# Sentences are converted directly from conllu lines (`parse`), without building TokenLists.
+#
+# Every conllu-file (or byte range) read by `Statistics` gets its own table of strings, which is dropped together with
+# its sentences, so memory does not grow with the number of files a process has read. Ids are valid within a table only
+# (except for the reserved strings, which have the same ids in every table), results of extraction are strings.
+
+from array import array
+from metrics import metrics
+
+
+# strings which are compared by extraction, interned first in every table
+RESERVED = ['VERB', 'NOUN', 'PROPN', 'ADP', 'NUM', 'PUNCT', 'case', 'fixed', 'не']
+
+
+class Strings:
+    '''Table of interned strings: every distinct string gets an integer id (0 is reserved for a missing value)
+    and the id of its lowercase variant.'''
+
+    def __init__(self):
+        self.ids = {None: 0}
+        self.strings = [None]
+        self.lower_ids = [0]
+        for string in RESERVED:
+            self.id(string)
+
+    def id(self, string):
+        i = self.ids.get(string)
+        if i is None:
+            i = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+            self.lower_ids.append(i)
+            lower = string.lower()
+            if lower != string:
+                self.lower_ids[i] = self.id(lower)
+        return i
+
+    def __len__(self):
+        return len(self.strings)
+
+
+VERB, NOUN, PROPN, ADP, NUM, PUNCT, CASE, FIXED, NE = [Strings().ids[string] for string in RESERVED]
+
+
+class CompactSentence:
+    '''A parsed sentence as parallel arrays of ids of its table of `strings`; `head` holds positions of head tokens (-1 for the root
+    and tokens without a head). Positions follow conllu lines, including multiword token ranges and empty nodes.'''
+
+    __slots__ = ['metadata', 'strings', 'form', 'lemma', 'upos', 'deprel', 'head', 'case', 'number', 'animacy']
+
+    def __init__(self, strings, metadata=None):
+        self.metadata = metadata or {}
+        self.strings = strings
+        for name in self.__slots__[2:]:
+            setattr(self, name, array('i'))
+
+    def __len__(self):
+        return len(self.upos)
+
+    def children(self):
+        '''Returns a list of positions of children of every token.'''
+        children = [[] for _ in self.head]
+        for position, head in enumerate(self.head):
+            if head >= 0:
+                children[head].append(position)
+        return children
+
+    def count_words(self):
+        '''Counts number of words (all tokens except punctuation).'''
+        return len(self.upos) - self.upos.tolist().count(PUNCT)
+
+    def _join_preposition(self, adp, children):
+        '''Returns a preposition form together with its fixed multiword parts (e.g. `в течение`).'''
+        strings, lower_ids = self.strings.strings, self.strings.lower_ids
+        preposition = [strings[lower_ids[self.form[adp]]]]
+        for adp_child in children[adp]:
+            if self.deprel[adp_child] == FIXED:
+                preposition.append(strings[lower_ids[self.form[adp_child]]])
+        return ' '.join(preposition)
+
+    def extract_all(self, prepositional_government):
+        '''Same as `Statistics._extract_all` of the TokenList of the sentence:
+            verbs, nouns, case, number, animacy, relation, prepositions, combinations, filtered
+        '''
+        strings, lower_ids = self.strings.strings, self.strings.lower_ids
+        form, lemma, upos, deprel = self.form, self.lemma, self.upos, self.deprel
+        case_ids, number_ids, animacy_ids = self.case, self.number, self.animacy
+        children = self.children()
+        verbs = []
+        nouns, case, number, animacy, relation = [], [], [], [], []
+        prepositions = []
+        combinations = []
+        filtered = []
+        for position, token_upos in enumerate(upos):
+            if token_upos == VERB:
+                verb_children = children[position]
+                negation = 'не_' * len([child for child in verb_children if lower_ids[form[child]] == NE])
+                verbs.append(negation + strings[lower_ids[lemma[position]]])
+                verb_lemma = negation + strings[lemma[position]]
+                for verb_child in verb_children:
+                    if upos[verb_child] not in (NOUN, PROPN):
+                        continue
+                    noun_children = children[verb_child]
+                    if any(upos[noun_child] == NUM for noun_child in noun_children):
+                        continue
+                    noun_feats = [lemma[verb_child], case_ids[verb_child], number_ids[verb_child], animacy_ids[verb_child], deprel[verb_child]]
+                    if not all(noun_feats):
+                        metrics.count('swallowed_exceptions')
+                        continue
+                    noun_feats = [strings[i] for i in noun_feats]
+                    preposition = [self._join_preposition(noun_child, children) for noun_child in noun_children \
+                        if (upos[noun_child] == ADP) and (deprel[noun_child] == CASE)]
+                    if preposition:
+                        preposition = ' '.join(preposition)
+                        combination = '__'.join([verb_lemma, preposition] + noun_feats)
+                        if (preposition in prepositional_government) and \
+                            (noun_feats[1] not in prepositional_government[preposition]):
+                            filtered.append(combination)
+                        else:
+                            combinations.append(combination)
+                    else:
+                        combinations.append('__'.join([verb_lemma, 'NO'] + noun_feats))
+            elif token_upos in (NOUN, PROPN):
+                nouns.append(strings[lower_ids[lemma[position]]])
+                for values, ids in [(case, case_ids), (number, number_ids), (animacy, animacy_ids)]:
+                    if not ids[position]:
+                        metrics.count('swallowed_exceptions')
+                        break
+                    values.append(strings[ids[position]])
+                else:
+                    relation.append(strings[deprel[position]])
+            elif (token_upos == ADP) and (deprel[position] == CASE):
+                prepositions.append(self._join_preposition(position, children))
+        return verbs, nouns, case, number, animacy, relation, prepositions, combinations, filtered
+
+
+def _feats(feats, strings):
+    '''Returns ids of Case, Number and Animacy values of a conllu feats field.'''
+    values = {'Case': 0, 'Number': 0, 'Animacy': 0}
+    if feats != '_':
+        for feat in feats.split('|'):
+            key, _, value = feat.partition('=')
+            if key in values:
+                values[key] = strings.id(value)
+    return values['Case'], values['Number'], values['Animacy']
+
+def parse(data, strings=None):
+    '''Converts conllu text (one or more sentences separated by blank lines) to a list of `CompactSentence`
+    with strings interned in `strings` (a new table by default; pass one table for all paragraphs of a file).
+    Raises ValueError on a malformed token line (e.g. a wrong number of fields or a head which is not a number).'''
+    if strings is None:
+        strings = Strings()
+    sentences = []
+    for paragraph in data.split('\n\n'):
+        lines = [line for line in paragraph.split('\n') if line.strip()]
+        if not lines:
+            continue
+        sentence = CompactSentence(strings)
+        heads = []
+        positions = {}
+        for line in lines:
+            if line.startswith('#'):
+                key, _, value = line[1:].partition('=')
+                if value:
+                    sentence.metadata[key.strip()] = value.strip()
+                continue
+            fields = line.rstrip('\r').split('\t')
+            if len(fields) != 10:
+                raise ValueError(f'Token line must have 10 fields: {line!r}')
+            token_id, form, lemma, upos, _, feats, head, deprel = fields[:8]
+            positions[token_id] = len(heads)
+            heads.append(int(head) if head != '_' else None)
+            sentence.form.append(strings.id(form))
+            sentence.lemma.append(strings.id(lemma))
+            sentence.upos.append(strings.id(upos))
+            sentence.deprel.append(strings.id(deprel))
+            case, number, animacy = _feats(feats, strings)
+            sentence.case.append(case)
+            sentence.number.append(number)
+            sentence.animacy.append(animacy)
+        if not heads:
+            continue
+        sentence.head.extend([positions.get(str(head), -1) if head else -1 for head in heads])
+        sentences.append(sentence)
+    return sentences
@@ -1,63 +1,313 @@
 import os
+import time
+import queue
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import tqdm
 import json
 from collections import Counter, defaultdict
 from minio import Minio
 import conllu
+from binary_statistics import write_binary_statistics, convert_json, merge_binary_statistics, BinaryStatistics
+from aggregate import Aggregate
+from approximate_counts import ApproximateCounter
+from metrics import metrics
+import compact_tokens
+from compact_tokens import CompactSentence
 
 class Statistics:
 
+    ENDPOINT = 'cosyco.ru:9000'
     ACCESS_KEY = ''
     SECRET_KEY = ''
     DIR_CONLLU = ''
     DIR_JSON = ''
+    # Manifest of downloaded conllu-files (stored in `DIR_CONLLU`)
+    DOWNLOADS = 'downloads.json'
+    # Parameters of approximate counting of combinations (see `approximate_counts`):
+    # width and depth of count-min sketches and the number of most frequent combinations which are kept
+    SKETCH_WIDTH = 1 << 20
+    SKETCH_DEPTH = 4
+    TOP_COMBINATIONS = 100000
+    # Number of example sentences of each combination kept in the index of a conllu-file by default (None keeps all of them)
+    EXAMPLES = None
+    # Statistics of a conllu-file
+    CONTENTS = ['sentences', 'words', 'verbs', 'nouns', 'case', 'number', 'animacy', 'relation', 'prepositions', 'combinations', 'filtered']
 
-    def __init__(self):
-        # Initializing Minio client object
-        self.minioClient = Minio(
-            'cosyco.ru:9000',
+    def __init__(self, minio_client=None, offline=False, compact=False):
+        # If `compact` is True, conllu-files are read into `compact_tokens.CompactSentence` objects instead of TokenLists
+        self.compact = compact
+        # Initializing Minio client object (any object with the same interface can be passed instead, e.g. `local_storage.LocalMinio`);
+        # an `offline` object (e.g. counting statistics of texts parsed by `analyzing.py --stream`) does not connect to cosyco
+        self.minioClient = None if offline else minio_client or Minio(
+            self.ENDPOINT,
             access_key=self.ACCESS_KEY,
             secret_key=self.SECRET_KEY,
             secure=False
             )
-        # List of Minio conllu-files
-        self.conllu_remote = [i.object_name[14:] for i in list(self.minioClient.list_objects('public', prefix='syntax-parsed/')) if 'short' not in i.object_name]
+        # List of Minio conllu-files with their etags and sizes
+        self.conllu_remote_info = {} if offline else \
+            {i.object_name[14:]: (i.etag, i.size) for i in self.minioClient.list_objects('public', prefix='syntax-parsed/') if 'short' not in i.object_name}
+        self.conllu_remote = list(self.conllu_remote_info)
         # List of local conllu-files
         self.conllu_local = os.listdir(self.DIR_CONLLU)
+        # Etags and sizes of downloaded conllu-files
+        self.downloads = {}
+        if self.DOWNLOADS in self.conllu_local:
+            with open(self.DIR_CONLLU+'/'+self.DOWNLOADS, encoding='utf-8') as file:
+                self.downloads = json.load(file)
+        self._downloads_lock = threading.Lock()
         # List of local json-files
         self.json_local = os.listdir(self.DIR_JSON)
         # Prepositional government
         with open('prepositional_government.json') as file:
             self.prepositional_government = json.load(file)
 
+    @classmethod
+    def _iter_paragraphs(self, conllu_file_name, start=0, end=None):
+        '''Yields byte offsets and contents of paragraphs (separated by blank lines) of a conllu-file.
+        If a byte range is given, only paragraphs starting in [start, end) are yielded.'''
+        with open(self.DIR_CONLLU+'/'+conllu_file_name, 'rb') as file:
+            file.seek(start)
+            position = start
+            offset = start
+            paragraph = []
+            for line in itertools.chain(file, [b'\n']):
+                if line.strip():
+                    if not paragraph:
+                        if (end is not None) and (position >= end):
+                            break
+                        offset = position
+                    paragraph.append(line)
+                elif paragraph:
+                    yield offset, b''.join(paragraph)
+                    paragraph = []
+                position += len(line)
+
+    @classmethod
+    def _shard_conllu(self, conllu_file_name, shards):
+        '''Splits a conllu-file into byte ranges of about equal size, which start on sentence boundaries.'''
+        size = os.path.getsize(self.DIR_CONLLU+'/'+conllu_file_name)
+        offsets = [0]
+        with open(self.DIR_CONLLU+'/'+conllu_file_name, 'rb') as file:
+            for i in range(1, shards):
+                file.seek(max(size*i//shards, offsets[-1]))
+                file.readline()
+                for line in iter(file.readline, b''):
+                    if not line.strip():
+                        break
+                offsets.append(file.tell())
+        offsets.append(size)
+        return [(start, end) for start, end in zip(offsets[:-1], offsets[1:]) if start < end]
+
+    @classmethod
+    def iter_tokenlists_from_conllu(self, conllu_file_name, malformed=None, start=0, end=None, offsets=False, compact=False):
+        '''Yields tokenlists of a conllu-file one by one without loading the whole file into memory
+        (or pairs of a byte offset of the paragraph and a tokenlist if `offsets` is True).
+        If `compact` is True, `compact_tokens.CompactSentence` objects are yielded instead of tokenlists.
+        Malformed paragraphs are skipped and reported; if `malformed` list is given, their byte offsets and errors are appended to it.'''
+        skipped = 0
+        # strings of compact sentences are interned in a table of this file (or byte range), which is dropped with them
+        strings = compact_tokens.Strings() if compact else None
+        for offset, paragraph in self._iter_paragraphs(conllu_file_name, start, end):
+            parse_start = time.perf_counter()
+            try:
+                tokenlists = compact_tokens.parse(paragraph.decode('utf-8'), strings) if compact else conllu.parse(paragraph.decode('utf-8'))
+            except Exception as error:
+                skipped += 1
+                metrics.count('malformed')
+                if malformed is not None:
+                    malformed.append((offset, repr(error)))
+            else:
+                metrics.add_time('parse', time.perf_counter() - parse_start)
+                for tokenlist in tokenlists:
+                    yield (offset, tokenlist) if offsets else tokenlist
+        if skipped:
+            print(f'Skipped {skipped} malformed paragraphs in `{conllu_file_name}`.')
+
     @classmethod
     def get_tokenlists_from_conllu(self, conllu_file_name):
         '''Converts conllu-file content to a list of tokenlists.'''
-        file = open(self.DIR_CONLLU+'/'+conllu_file_name, 'r', encoding = 'utf-8')
-        data = file.read().split('\n\n')
-        tokenlists = []
-        for paragraph in data:
-            try:
-                tokenlists.extend([tokenlist for tokenlist in conllu.parse(paragraph)])
-            except:
-                pass
-        file.close()
-        return tokenlists
+        return list(self.iter_tokenlists_from_conllu(conllu_file_name))
+
+    def _is_downloaded(self, conllu_file_name):
+        '''Checks if a local conllu-file matches etag and size of Minio conllu-object.'''
+        path = self.DIR_CONLLU+'/'+conllu_file_name
+        if not os.path.exists(path):
+            return False
+        etag, size = self.conllu_remote_info[conllu_file_name]
+        if conllu_file_name not in self.downloads:
+            # file downloaded before the manifest was kept
+            if os.path.getsize(path) != size:
+                return False
+            self.downloads[conllu_file_name] = {'etag': etag, 'size': size}
+        return (self.downloads[conllu_file_name] == {'etag': etag, 'size': size}) and (os.path.getsize(path) == size)
+
+    def _download(self, conllu_file_name):
+        '''Downloads Minio conllu-object to a partial file and renames it when finished.
+        A partial file left by an interrupted download of the same object version is resumed.'''
+        etag, size = self.conllu_remote_info[conllu_file_name]
+        path = self.DIR_CONLLU+'/'+conllu_file_name
+        offset = 0
+        with self._downloads_lock:
+            partial = self.downloads.get(conllu_file_name+'.part')
+        if (partial == {'etag': etag, 'size': size}) and os.path.exists(path+'.part'):
+            offset = os.path.getsize(path+'.part')
+        with self._downloads_lock:
+            self.downloads[conllu_file_name+'.part'] = {'etag': etag, 'size': size}
+            self._save_downloads()
+        if offset < size:
+            with metrics.timer('download'):
+                response = self.minioClient.get_object('public', 'syntax-parsed/'+conllu_file_name, offset=offset)
+                try:
+                    with open(path+'.part', 'ab' if offset else 'wb') as file:
+                        for chunk in response.stream(1 << 20):
+                            file.write(chunk)
+                            metrics.count('downloaded_bytes', len(chunk))
+                finally:
+                    response.close()
+                    response.release_conn()
+        if os.path.getsize(path+'.part') != size:
+            raise IOError(f'Downloaded file `{conllu_file_name}` has size {os.path.getsize(path+".part")} instead of {size}.')
+        os.replace(path+'.part', path)
+        with self._downloads_lock:
+            self.downloads.pop(conllu_file_name+'.part')
+            self.downloads[conllu_file_name] = {'etag': etag, 'size': size}
+            self._save_downloads()
+            if conllu_file_name not in self.conllu_local:
+                self.conllu_local.append(conllu_file_name)
+
+    def _save_downloads(self):
+        with open(self.DIR_CONLLU+'/'+self.DOWNLOADS+'.tmp', 'w', encoding='utf-8') as file:
+            json.dump(self.downloads, file, ensure_ascii=False)
+        os.replace(self.DIR_CONLLU+'/'+self.DOWNLOADS+'.tmp', self.DIR_CONLLU+'/'+self.DOWNLOADS)
 
     def download_from_cosyco(self, conllu_file_name):
         '''Downloads Minio conllu-object.'''
-        if conllu_file_name not in self.conllu_local:
-            self.minioClient.fget_object('public', 'syntax-parsed/'+conllu_file_name, self.DIR_CONLLU+'/'+conllu_file_name)
-            self.conllu_local = os.listdir(self.DIR_CONLLU)
+        if not self._is_downloaded(conllu_file_name):
+            self._download(conllu_file_name)
         else:
             print(f'File {conllu_file_name} has already been downloaded. Please check `{self.DIR_CONLLU}` directory.')
 
+    def download_many(self, conllu_files=None, concurrency=8):
+        '''Downloads Minio conllu-objects (all of them by default) in `concurrency` threads.
+        Files which are up to date (by etag and size) are skipped, interrupted downloads are resumed.
+        Returns a dictionary of files which failed to download with their errors.'''
+        if conllu_files is None:
+            conllu_files = self.conllu_remote
+        to_download = [file for file in conllu_files if not self._is_downloaded(file)]
+        print(f'Downloading {len(to_download)} files ({len(conllu_files) - len(to_download)} are up to date)...')
+        errors = {}
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = {executor.submit(self._download, file): file for file in to_download}
+            for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    future.result()
+                except Exception as error:
+                    errors[futures[future]] = repr(error)
+        if errors:
+            print(f'Failed to download {len(errors)} files: {list(errors)}')
+        metrics.emit('download_many')
+        return errors
+
+    def _download_with_retries(self, conllu_file_name, retries=3, backoff=1.0):
+        '''Downloads Minio conllu-object, retrying a failed download after `backoff`, 2*`backoff`, 4*`backoff`, ... seconds
+        (from the partial file, so that the downloaded part is not fetched again).'''
+        for attempt in range(retries + 1):
+            try:
+                return self._download(conllu_file_name)
+            except Exception as error:
+                if attempt == retries:
+                    raise
+                delay = backoff * 2 ** attempt
+                metrics.count('download_retries')
+                print(f'Failed to download `{conllu_file_name}` ({error!r}), retrying in {delay:.1f} s...')
+                time.sleep(delay)
+
+    def evict(self, conllu_file_name):
+        '''Removes a local conllu-file (and its partial download) to free disk space.'''
+        path = self.DIR_CONLLU+'/'+conllu_file_name
+        for file in [path, path+'.part']:
+            if os.path.exists(file):
+                os.remove(file)
+        with self._downloads_lock:
+            self.downloads.pop(conllu_file_name, None)
+            self.downloads.pop(conllu_file_name+'.part', None)
+            self._save_downloads()
+            if conllu_file_name in self.conllu_local:
+                self.conllu_local.remove(conllu_file_name)
+
+    def process_all(self, conllu_files=None, concurrency=4, workers=2, evict=False, max_local=None, retries=3, backoff=1.0, examples=None, binary=False,
+            approximate=False):
+        '''Collects statistics (see `get_statistics`) of Minio conllu-files (all of them by default) without waiting for
+        one file to be downloaded before counting another: files are downloaded in `concurrency` threads and each downloaded file
+        is counted at once in a pool of `workers` processes. Failed downloads are retried `retries` times with exponential backoff.
+        If `evict` is True, a conllu-file is removed as soon as its statistics are saved and at most `max_local` files
+        (2*(`concurrency` + `workers`) by default) are kept on disk at once; `find_text` then needs the file to be downloaded again.
+        Files with collected statistics are skipped. Returns a dictionary of files which failed with their errors.'''
+        if examples is None:
+            examples = self.EXAMPLES
+        if conllu_files is None:
+            conllu_files = self.conllu_remote
+        to_process = [file for file in conllu_files if file[:-7]+'.json' not in self.json_local]
+        downloaded = {file for file in to_process if self._is_downloaded(file)}
+        print(f'Collecting statistics of {len(to_process)} files ({len(downloaded)} are downloaded, {len(conllu_files) - len(to_process)} are collected)...')
+        # metrics of the run; every file is also emitted with its own metrics
+        metrics.reset()
+        slots = threading.Semaphore(max_local or 2*(concurrency + workers)) if evict else None
+        # (file, result, error) of processed files, in the order they are finished
+        done = queue.Queue()
+        errors = {}
+
+        def fetch(file):
+            # every file puts exactly one (file, result, error) on `done`, whatever fails
+            if slots:
+                slots.acquire()
+            try:
+                if file not in downloaded:
+                    self._download_with_retries(file, retries, backoff)
+                pool.apply_async(self._count_shard, ((file, 0, None, examples, approximate),),
+                    callback=lambda result: done.put((file, result, None)),
+                    error_callback=lambda error: done.put((file, None, error)))
+            except Exception as error:
+                done.put((file, None, error))
+
+        with multiprocessing.Pool(workers) as pool, ThreadPoolExecutor(concurrency) as executor:
+            for file in to_process:
+                executor.submit(fetch, file)
+            for _ in tqdm.tqdm(range(len(to_process))):
+                file, result, error = done.get()
+                if error is None:
+                    contents, index, file_metrics = result
+                    metrics.merge(file_metrics)
+                    try:
+                        self.save_statistics(file, contents, index, binary)
+                    except Exception as save_error:
+                        error = save_error
+                    else:
+                        metrics.emit(f'process_all {file}', file_metrics)
+                if error is not None:
+                    errors[file] = repr(error)
+                if evict:
+                    self.evict(file)
+                    slots.release()
+        if errors:
+            print(f'Failed to collect statistics of {len(errors)} files: {list(errors)}')
+        print(metrics)
+        return errors
+
     def _count_words(self, tokenlist):
         '''Counts number of words (all tokens except punctuation) in a tokenlist.'''
+        if isinstance(tokenlist, CompactSentence):
+            return tokenlist.count_words()
         return len([token for token in tokenlist if token['upos'] != 'PUNCT'])
 
     def _extract_verbs(self, tokenlist):
         '''Extracts all verbs (including negative-polarized ones) from a tokenlist.'''
+        if isinstance(tokenlist, CompactSentence):
+            return self._extract_all(tokenlist)[0]
         verbs = []
         for token in tokenlist:
             if token['upos'] == 'VERB':
@@ -73,6 +323,8 @@ class Statistics:
 
     def _extract_nouns(self, tokenlist):
         '''Extracts all nouns with grammar features from a tokenlist.'''
+        if isinstance(tokenlist, CompactSentence):
+            return self._extract_all(tokenlist)[1:6]
         nouns = []
         case = []
         number = []
@@ -92,6 +344,8 @@ class Statistics:
 
     def _extract_prepositions(self, tokenlist):
         '''Extracts all prepositions from a tokenlist.'''
+        if isinstance(tokenlist, CompactSentence):
+            return self._extract_all(tokenlist)[6]
         prepositions = []
         for token in tokenlist:
             if (token['upos'] == 'ADP') and (token['deprel'] == 'case'):
@@ -110,6 +364,8 @@ class Statistics:
             - correct,
             - incorrect (filtered by a prepositional government dictionary)
         '''
+        if isinstance(tokenlist, CompactSentence):
+            return self._extract_all(tokenlist)[7:]
         combinations = []
         filtered = []
         for token in tokenlist:
@@ -120,7 +376,7 @@ class Statistics:
                         if (verb_child['head'] == token['id']) and (verb_child['form'].lower() == 'не'):
                             verb_lemma = 'не_'+verb_lemma
                     except (KeyError, TypeError):
-                        pass
+                        metrics.count('swallowed_exceptions')
                 for verb_child in tokenlist:
                     try:
                         if (verb_child['head'] == token['id']) and \
@@ -132,7 +388,7 @@ class Statistics:
                                         (noun_child['upos'] == 'NUM'):
                                         num += 1
                                 except (KeyError, TypeError):
-                                    pass
+                                    metrics.count('swallowed_exceptions')
                             if num == 0:                    
                                 try:
                                     noun_lemma = verb_child['lemma']
@@ -158,18 +414,159 @@ class Statistics:
                                                 filtered.append(str(verb_lemma+'__'+preposition+'__'+noun_lemma+'__'+noun_case+'__'+noun_number+'__'+noun_anim+'__'+noun_rel))
                                             else:
                                                 combinations.append(str(verb_lemma+'__'+preposition+'__'+noun_lemma+'__'+noun_case+'__'+noun_number+'__'+noun_anim+'__'+noun_rel))
-                                        except:
-                                            pass
+                                        except Exception:
+                                            metrics.count('swallowed_exceptions')
                                     else:
                                         preposition = 'NO'
                                         combinations.append(str(verb_lemma+'__'+preposition+'__'+noun_lemma+'__'+noun_case+'__'+noun_number+'__'+noun_anim+'__'+noun_rel))
-                                except:
-                                    pass
+                                except Exception:
+                                    metrics.count('swallowed_exceptions')
                     except (KeyError, TypeError):
-                        pass
+                        metrics.count('swallowed_exceptions')
         return combinations, filtered
 
-    def get_statistics(self, conllu_file_name):
+    def _index_children(self, tokenlist):
+        '''Returns a dictionary of tokens grouped by their head id.'''
+        children = defaultdict(list)
+        for token in tokenlist:
+            children[token.get('head')].append(token)
+        return children
+
+    def _join_preposition(self, adp, children):
+        '''Returns a preposition form together with its fixed multiword parts (e.g. `в течение`).'''
+        preposition = [adp['form'].lower()]
+        for adp_child in children.get(adp['id'], ()):
+            if adp_child['deprel'] == 'fixed':
+                preposition.append(adp_child['form'].lower())
+        return ' '.join(preposition)
+
+    def _extract_all(self, tokenlist):
+        '''Extracts verbs, nouns with grammar features, prepositions and combinations from a tokenlist in a single traversal.
+        Returns the same lists as `_extract_verbs`, `_extract_nouns`, `_extract_prepositions` and `_extract_combinations`:
+            verbs, nouns, case, number, animacy, relation, prepositions, combinations, filtered
+        A `compact_tokens.CompactSentence` is processed by its own `extract_all`.
+        '''
+        if isinstance(tokenlist, CompactSentence):
+            return tokenlist.extract_all(self.prepositional_government)
+        children = self._index_children(tokenlist)
+        verbs = []
+        nouns, case, number, animacy, relation = [], [], [], [], []
+        prepositions = []
+        combinations = []
+        filtered = []
+        for token in tokenlist:
+            upos = token['upos']
+            if upos == 'VERB':
+                verb_children = children.get(token['id'], ())
+                negation = 'не_' * len([child for child in verb_children if child['form'].lower() == 'не'])
+                verbs.append(negation + token['lemma'].lower())
+                verb_lemma = negation + token['lemma']
+                for verb_child in verb_children:
+                    if verb_child['upos'] not in ['NOUN', 'PROPN']:
+                        continue
+                    noun_children = children.get(verb_child['id'], ())
+                    if any(noun_child['upos'] == 'NUM' for noun_child in noun_children):
+                        continue
+                    try:
+                        noun_feats = [
+                            verb_child['lemma'],
+                            verb_child['feats']['Case'],
+                            verb_child['feats']['Number'],
+                            verb_child['feats']['Animacy'],
+                            verb_child['deprel']
+                        ]
+                        preposition = [self._join_preposition(noun_child, children) for noun_child in noun_children \
+                            if (noun_child['upos'] == 'ADP') and (noun_child['deprel'] == 'case')]
+                        if preposition:
+                            preposition = ' '.join(preposition)
+                            combination = '__'.join([verb_lemma, preposition] + noun_feats)
+                            if (preposition in self.prepositional_government) and \
+                                (noun_feats[1] not in self.prepositional_government[preposition]):
+                                filtered.append(combination)
+                            else:
+                                combinations.append(combination)
+                        else:
+                            combinations.append('__'.join([verb_lemma, 'NO'] + noun_feats))
+                    except (KeyError, TypeError):
+                        metrics.count('swallowed_exceptions')
+            elif upos in ['NOUN', 'PROPN']:
+                nouns.append(token['lemma'].lower())
+                try:
+                    case.append(token['feats']['Case'])
+                    number.append(token['feats']['Number'])
+                    animacy.append(token['feats']['Animacy'])
+                    relation.append(token['deprel'])
+                except (KeyError, TypeError):
+                    metrics.count('swallowed_exceptions')
+            elif (upos == 'ADP') and (token['deprel'] == 'case'):
+                prepositions.append(self._join_preposition(token, children))
+        return verbs, nouns, case, number, animacy, relation, prepositions, combinations, filtered
+
+    def __getstate__(self):
+        # Minio client is not passed to worker processes
+        state = self.__dict__.copy()
+        state.pop('minioClient', None)
+        state.pop('_downloads_lock', None)
+        state['DIR_CONLLU'] = self.DIR_CONLLU
+        state['DIR_JSON'] = self.DIR_JSON
+        return state
+
+    def __setstate__(self, state):
+        # Worker processes started with `spawn` do not inherit class attributes, which are used by classmethods
+        self.__dict__.update(state)
+        type(self).DIR_CONLLU = state['DIR_CONLLU']
+        type(self).DIR_JSON = state['DIR_JSON']
+
+    def _count_statistics(self, conllu_file_name, start=0, end=None, progress=False, examples=None, approximate=False):
+        '''Returns counts of sentences and words and counters of verbs, nouns, case, number, animacy, relation,
+        prepositions, combinations and filtered combinations of a conllu-file (or its byte range),
+        and an index of byte offsets of sentences (at most `examples` per combination, all of them if `examples` is None) for each combination.
+        If `approximate` is True, combinations are counted approximately (see `new_contents`) and the index is not built (None).'''
+        contents = self.new_contents(approximate)
+        index = None if approximate else defaultdict(list)
+        tokenlists = self.iter_tokenlists_from_conllu(conllu_file_name, start=start, end=end, offsets=True, compact=self.compact)
+        if progress:
+            tokenlists = tqdm.tqdm(tokenlists)
+        for offset, tokenlist in tokenlists:
+            self._count_tokenlist(contents, index, tokenlist, offset, examples)
+        return contents, index
+
+    def _count_tokenlist(self, contents, index, tokenlist, example, examples=None):
+        '''Adds counts of a tokenlist to `contents` and its `example` (a byte offset of the sentence or its text)
+        to `index` of each of its combinations (at most `examples` per combination, unbounded if `examples` is None) unless `index` is None.'''
+        extract_start = time.perf_counter()
+        extracted = self._extract_all(tokenlist)
+        count_start = time.perf_counter()
+        contents[0] += 1
+        contents[1] += self._count_words(tokenlist)
+        for i, j in zip(range(2, 11), extracted):
+            contents[i].update(j)
+        for key in dict.fromkeys(extracted[7] + extracted[8]) if index is not None else ():
+            found = index[key]
+            if ((examples is None) or (len(found) < examples)) and (not found or found[-1] != example):
+                found.append(example)
+        count_end = time.perf_counter()
+        metrics.add_time('extract', count_start - extract_start)
+        metrics.add_time('count', count_end - count_start)
+        metrics.count('sentences')
+        metrics.count('tokens', len(tokenlist))
+        metrics.tick()
+
+    def _count_shard(self, shard):
+        # metrics of a worker process are returned to the main process, which emits them
+        metrics.reset()
+        metrics.path = None
+        conllu_file_name, start, end, examples, approximate = shard
+        return (*self._count_statistics(conllu_file_name, start, end, examples=examples, approximate=approximate), metrics.state())
+
+    def read_index(self, conllu_file_name):
+        '''Opens json-file with an index of sentence byte offsets of combinations of a conllu-file (None if it is not built).'''
+        if conllu_file_name[:-7]+'.index.json' not in self.json_local:
+            return None
+        with open(self.DIR_JSON+'/'+conllu_file_name[:-7]+'.index.json', encoding='utf-8') as file:
+            return json.load(file)
+
+    def get_statistics(self, conllu_file_name, workers=1, examples=None, binary=False, approximate=False):
         '''Save all statistics from a given conllu-file to json-file:
             1) count of:
             - sentences,
@@ -184,53 +581,117 @@ class Statistics:
             - prepositions,
             - correct verb combinations,
             - incorrect verb combinations (filtered by a prepositional government dictionary)
+        If `workers` > 1, the file is split into shards on sentence boundaries, which are processed in parallel.
+        Byte offsets of sentences (at most `examples` per combination, EXAMPLES if it is not given) are saved to `<file>.index.json`
+        for `find_text`; if neither is set, every occurrence is kept, so the index grows as large as the statistics.
+        If `binary` is True, statistics are also saved to `<file>.stats` binary file (see `binary_statistics`).
+        If `approximate` is True, combinations are counted with fixed memory (see `new_contents`): only TOP_COMBINATIONS
+        most frequent ones are saved with estimated counts, error bounds are saved under `approximate` key,
+        sketches are saved to `<file>.combinations.sketch.npz` and `<file>.filtered.sketch.npz` for `join_statistics`
+        and no index is built (`find_text` scans the file).
         '''
+        if examples is None:
+            examples = self.EXAMPLES
         if conllu_file_name[:-7]+'.json' not in self.json_local:
+            # metrics are reported per file
+            metrics.reset()
             if conllu_file_name not in self.conllu_local:
                 print(f'Downloading `{conllu_file_name}` from cosyco...')
                 self.download_from_cosyco(conllu_file_name)
-            print(f'Loading data from `{conllu_file_name}`...')
-            tokenlists = self.get_tokenlists_from_conllu(conllu_file_name)
             print(f'Counting statistics from `{conllu_file_name}`...')
-            contents_types = ['sentences', 'words', 'verbs', 'nouns', 'case', 'number', 'animacy', 'relation', 'prepositions', 'combinations', 'filtered']
-            contents = [0, 0, Counter(), Counter(), Counter(), Counter(), Counter(), Counter(), Counter(), Counter(), Counter()]
-            contents[0] = len(tokenlists)
-            for tokenlist in tqdm.tqdm(tokenlists):
-                contents[1] += self._count_words(tokenlist)
-                verbs = self._extract_verbs(tokenlist)
-                nouns, case, number, animacy, relation = self._extract_nouns(tokenlist)
-                prepositions = self._extract_prepositions(tokenlist)
-                for i, j in zip(range(2, 9), [verbs, nouns, case, number, animacy, relation, prepositions]):
-                    contents[i].update(j)
-                combinations, filtered = self._extract_combinations(tokenlist)
-                contents[9].update(combinations)
-                contents[10].update(filtered)
+            if workers > 1:
+                shards = [(conllu_file_name, start, end, examples, approximate) for start, end in self._shard_conllu(conllu_file_name, workers*4)]
+                contents = self.new_contents(approximate)
+                index = None if approximate else defaultdict(list)
+                with multiprocessing.Pool(workers) as pool:
+                    for shard_contents, shard_index, shard_metrics in tqdm.tqdm(pool.imap(self._count_shard, shards), total=len(shards)):
+                        metrics.merge(shard_metrics)
+                        metrics.tick()
+                        for i in range(2):
+                            contents[i] += shard_contents[i]
+                        for i in range(2, 11):
+                            contents[i].update(shard_contents[i])
+                        for key, offsets in (shard_index or {}).items():
+                            index[key].extend(offsets[:examples - len(index[key])] if examples is not None else offsets)
+            else:
+                contents, index = self._count_statistics(conllu_file_name, progress=True, examples=examples, approximate=approximate)
+            self.save_statistics(conllu_file_name, contents, index, binary)
+            metrics.emit(f'get_statistics {conllu_file_name}')
+            print(metrics)
+        else:
+            print(f'For file `{conllu_file_name}` statistics have already been collected. To recollect statistics remove json-file from directory `{self.DIR_JSON}`.')
+
+    def new_contents(self, approximate=False):
+        '''Returns empty counts of sentences and words and counters of statistics (in the order of `CONTENTS`).
+        If `approximate` is True, combinations and filtered combinations are counted by `approximate_counts.ApproximateCounter`
+        with fixed memory (SKETCH_WIDTH, SKETCH_DEPTH, TOP_COMBINATIONS) instead of Counter.'''
+        return [0, 0] + [Counter() for _ in self.CONTENTS[2:9]] + \
+            [self.new_approximate_counter() if approximate else Counter() for _ in self.CONTENTS[9:]]
+
+    def new_approximate_counter(self):
+        return ApproximateCounter(self.SKETCH_WIDTH, self.SKETCH_DEPTH, self.TOP_COMBINATIONS)
+
+    def save_statistics(self, conllu_file_name, contents, index, binary=False, texts=False):
+        '''Saves counted statistics of a conllu-file to `<file>.json` and its index of sentence byte offsets to `<file>.index.json`
+        (or of sentence texts to `<file>.examples.json` if `texts` is True, when there is no conllu-file to read them from).'''
+        with metrics.timer('serialize'):
+            approximate = {}
+            for i in range(9, 11):
+                if isinstance(contents[i], ApproximateCounter):
+                    contents[i].save(self.DIR_JSON+'/'+conllu_file_name[:-7]+'.'+self.CONTENTS[i]+'.sketch.npz')
+                    approximate[self.CONTENTS[i]] = contents[i].error_bounds()
             for i in range(2, 11):
                 contents[i] = dict(contents[i].most_common())
             to_dump = {}
-            for i, j in zip(contents_types, contents):
+            for i, j in zip(self.CONTENTS, contents):
                 to_dump[i] = j
+            if approximate:
+                to_dump['approximate'] = approximate
             json_object = json.dumps(to_dump, ensure_ascii=False)
             with open(self.DIR_JSON+'/'+conllu_file_name[:-7]+'.json', 'w', encoding='utf-8') as file:
                 file.write(json_object)
-            self.json_local = os.listdir(self.DIR_JSON)
-        else:
-            print(f'For file `{conllu_file_name}` statistics have already been collected. To recollect statistics remove json-file from directory `{self.DIR_JSON}`.')
+            if index is not None:
+                with open(self.DIR_JSON+'/'+conllu_file_name[:-7]+('.examples.json' if texts else '.index.json'), 'w', encoding='utf-8') as file:
+                    json.dump(index, file, ensure_ascii=False)
+            if binary:
+                write_binary_statistics(to_dump, self.DIR_JSON+'/'+conllu_file_name[:-7]+'.stats')
+        self.json_local = os.listdir(self.DIR_JSON)
 
-    def read_statistics(self, json_file_name):
-        '''Opens json-file with statistics'''
+    def read_statistics(self, json_file_name, mmap=False):
+        '''Opens json-file with statistics.
+        If `mmap` is True, opens binary file `<name>.stats` instead: only accessed entries are read and decoded.'''
+        if mmap:
+            return BinaryStatistics(self.DIR_JSON+'/'+json_file_name[:-5]+'.stats')
         with open(self.DIR_JSON+'/'+json_file_name, encoding='utf-8') as file:
             statistics = json.load(file)
         return statistics
 
-    def join_statistics(self, conllu_files: list, save_to=''):
-        '''Returns joined statistics of json-files.'''
+    def join_statistics(self, conllu_files: list, save_to='', mmap=False, external=False, top=None, sort=False, approximate=False):
+        '''Returns joined statistics of json-files (or binary `.stats` files if `mmap` is True).
+        If `external` is True, statistics are joined by a k-way merge of binary files sorted by keys (missing ones are converted
+        from json-files) and saved to `save_to` with bounded memory. Keys are then saved in bytewise order, unless `top` most frequent
+        keys or a full frequency sort (`sort`) are requested.
+        If `approximate` is True, combinations are joined with fixed memory by merging sketches of files counted by
+        `get_statistics(approximate=True)` (exact counts of other files are added to the sketches); joined sketches are
+        saved to `<save_to>.combinations.sketch.npz` and `<save_to>.filtered.sketch.npz`.'''
+        if approximate and external:
+            raise ValueError('Approximate statistics are joined in memory, `external` merge is only exact.')
         for file in conllu_files:
-            if file[:-7]+'.json' not in self.json_local:
+            if (file[:-7]+('.stats' if mmap else '.json') not in self.json_local) and \
+                not (external and (file[:-7]+'.stats' in self.json_local)):
                 raise FileNotFoundError(f'For file `{file}` statistics not found. Apply `get_statistics` function to the file.')
         if save_to:
             if save_to+'.json' in self.json_local:
                 raise NameError('File with this name already exists. Please choose another name.')
+        if external:
+            if not save_to:
+                raise ValueError('Joined statistics of external merge are saved to a file, `save_to` is required.')
+            for file in conllu_files:
+                if file[:-7]+'.stats' not in self.json_local:
+                    convert_json(self.DIR_JSON+'/'+file[:-7]+'.json')
+            merge_binary_statistics([self.DIR_JSON+'/'+file[:-7]+'.stats' for file in conllu_files], self.DIR_JSON+'/'+save_to+'.json', top, sort)
+            self.json_local = os.listdir(self.DIR_JSON)
+            return
         stats = {
             'sentences': 0, 
             'words': 0,
@@ -241,16 +702,33 @@ class Statistics:
             'animacy': Counter(),
             'relation': Counter(),
             'prepositions': Counter(),
-            'combinations': Counter(),
-            'filtered': Counter()
+            'combinations': self.new_approximate_counter() if approximate else Counter(),
+            'filtered': self.new_approximate_counter() if approximate else Counter()
         }
         for file in conllu_files:
-            with open(self.DIR_JSON+'/'+file[:-7]+'.json', 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
+            if mmap:
+                json_data = self.read_statistics(file[:-7]+'.json', mmap=True)
+            else:
+                with open(self.DIR_JSON+'/'+file[:-7]+'.json', 'r', encoding='utf-8') as f:
+                    json_data = json.load(f)
             for i in ['sentences', 'words']:
                 stats[i] += json_data[i]
             for i in ['verbs', 'nouns', 'case', 'number', 'animacy', 'relation', 'prepositions', 'combinations', 'filtered']:
-                stats[i].update(json_data[i])
+                if approximate and (file[:-7]+'.'+i+'.sketch.npz' in self.json_local):
+                    stats[i].update(ApproximateCounter.load(self.DIR_JSON+'/'+file[:-7]+'.'+i+'.sketch.npz'))
+                elif mmap and not approximate:
+                    for key, count in json_data[i].items():
+                        stats[i][key] += count
+                else:
+                    stats[i].update(json_data[i])
+            if mmap:
+                json_data.close()
+        if approximate:
+            stats['approximate'] = {}
+            for i in ['combinations', 'filtered']:
+                if save_to:
+                    stats[i].save(self.DIR_JSON+'/'+save_to+'.'+i+'.sketch.npz')
+                stats['approximate'][i] = stats[i].error_bounds()
         for i in ['verbs', 'nouns', 'case', 'number', 'animacy', 'relation', 'prepositions', 'combinations', 'filtered']:
             stats[i] = dict(stats[i].most_common())
         if save_to:
@@ -261,112 +739,82 @@ class Statistics:
         else:
             return stats
 
-    def filter_combinations(self, combinations: dict, verb='', prep='', noun='', case='', num='', anim='', rel=''):
+    def update_aggregate(self, name, conllu_files: list, save_to=''):
+        '''Updates persistent joined statistics `<name>.aggregate` (e.g. for the whole corpus or a genre) so that it contains
+        statistics of exactly the given files: statistics of new files are added, of removed files are subtracted,
+        of files with changed json-files are replaced. Returns lists of added, removed and replaced files.
+        If `save_to` is given, joined statistics are also saved to json-file.'''
+        for file in conllu_files:
+            if file[:-7]+'.json' not in self.json_local:
+                raise FileNotFoundError(f'For file `{file}` statistics not found. Apply `get_statistics` function to the file.')
+        if save_to:
+            if save_to+'.json' in self.json_local:
+                raise NameError('File with this name already exists. Please choose another name.')
+        aggregate = Aggregate(self.DIR_JSON+'/'+name+'.aggregate')
+        try:
+            changes = aggregate.update({file: self.DIR_JSON+'/'+file[:-7]+'.json' for file in conllu_files})
+            print(f'Aggregate `{name}`: added {len(changes["added"])}, removed {len(changes["removed"])}, replaced {len(changes["replaced"])} files.')
+            if save_to:
+                with open(self.DIR_JSON+'/'+save_to+'.json', 'w', encoding='utf-8') as f:
+                    f.write(json.dumps(aggregate.statistics(), ensure_ascii=False))
+        finally:
+            aggregate.close()
+        self.json_local = os.listdir(self.DIR_JSON)
+        return changes
+
+    def filter_combinations(self, combinations, verb='', prep='', noun='', case='', num='', anim='', rel=''):
         '''Returns filtered frequency dictionary for combinations or combinations filtered by prepositional government.
-        Filter can be applied to verb, preposition, noun, case, number of noun or syntax relation tag.'''
-        args_dict = {i: j for i, j in enumerate([verb, prep, noun, case, num, anim, rel]) if j}
-        args = list(args_dict.items())
-        n = len(args)
-        if n == 1:
-            return (dict(filter(lambda x: \
-                x[0].split('__')[args[0][0]] == args[0][1], 
-                combinations.items()
-            )))
-        if n == 2:
-            return (dict(filter(lambda x: \
-                x[0].split('__')[args[0][0]] == args[0][1] and \
-                x[0].split('__')[args[1][0]] == args[1][1],
-                combinations.items()
-            )))
-        if n == 3:
-            return (dict(filter(lambda x: \
-                x[0].split('__')[args[0][0]] == args[0][1] and \
-                x[0].split('__')[args[1][0]] == args[1][1] and \
-                x[0].split('__')[args[2][0]] == args[2][1],
-                combinations.items()
-            )))
-        if n == 4:
-            return (dict(filter(lambda x: \
-                x[0].split('__')[args[0][0]] == args[0][1] and \
-                x[0].split('__')[args[1][0]] == args[1][1] and \
-                x[0].split('__')[args[2][0]] == args[2][1] and \
-                x[0].split('__')[args[3][0]] == args[3][1],
-                combinations.items()
-            )))
-        if n == 5:
-            return (dict(filter(lambda x: \
-                x[0].split('__')[args[0][0]] == args[0][1] and \
-                x[0].split('__')[args[1][0]] == args[1][1] and \
-                x[0].split('__')[args[2][0]] == args[2][1] and \
-                x[0].split('__')[args[3][0]] == args[3][1] and \
-                x[0].split('__')[args[4][0]] == args[4][1],
-                combinations.items()
-            )))
-        if n == 6:
-            return (dict(filter(lambda x: \
-                x[0].split('__')[args[0][0]] == args[0][1] and \
-                x[0].split('__')[args[1][0]] == args[1][1] and \
-                x[0].split('__')[args[2][0]] == args[2][1] and \
-                x[0].split('__')[args[3][0]] == args[3][1] and \
-                x[0].split('__')[args[4][0]] == args[4][1] and \
-                x[0].split('__')[args[5][0]] == args[5][1],
-                combinations.items()
-            )))
-        if n == 7:
-            return (dict(filter(lambda x: \
-                x[0].split('__')[args[0][0]] == args[0][1] and \
-                x[0].split('__')[args[1][0]] == args[1][1] and \
-                x[0].split('__')[args[2][0]] == args[2][1] and \
-                x[0].split('__')[args[3][0]] == args[3][1] and \
-                x[0].split('__')[args[4][0]] == args[4][1] and \
-                x[0].split('__')[args[5][0]] == args[5][1] and \
-                x[0].split('__')[args[6][0]] == args[6][1],
-                combinations.items()
-            )))
-        else:
+        Filter can be applied to verb, preposition, noun, case, number of noun or syntax relation tag.
+        If `combinations` is a `CombinationsStore`, filtering is vectorized and a filtered store is returned
+        (its `filter` method also accepts lists of values and negated criteria).'''
+        if not isinstance(combinations, dict):
+            return combinations.filter(**{i: j for i, j in zip(combinations.FIELDS, [verb, prep, noun, case, num, anim, rel]) if j})
+        args = [(i, j) for i, j in enumerate([verb, prep, noun, case, num, anim, rel]) if j]
+        if not args:
             return combinations
+        filtered = {}
+        for key, value in combinations.items():
+            fields = key.split('__')
+            if all(fields[i] == j for i, j in args):
+                filtered[key] = value
+        return filtered
+
+    def _read_paragraph(self, file, offset):
+        '''Returns tokenlists (or compact sentences) of a paragraph starting at a byte offset of an opened conllu-file.'''
+        file.seek(offset)
+        paragraph = []
+        for line in iter(file.readline, b''):
+            if not line.strip():
+                break
+            paragraph.append(line)
+        return (compact_tokens.parse if self.compact else conllu.parse)(b''.join(paragraph).decode('utf-8'))
 
     def find_text(self, freq_dict: dict, conllu_files: list):
-        '''Returns a list of example sentences to a given frequency dictionary of combinations or combinations filtered by prepositional government.'''
+        '''Returns a list of example sentences to a given frequency dictionary of combinations or combinations filtered by prepositional government.
+        Sentences are read by offsets from the index of a conllu-file built by `get_statistics` (so there are at most its `examples`
+        sentences per combination of a file, if they were capped); files without an index are scanned once for all combinations
+        with the same extraction (`_extract_all`). For files counted while parsing (`analyzing.py --stream`) sentences are taken from `<file>.examples.json`.'''
         examples = defaultdict(list)
-        for key in freq_dict.keys():
-            verb, prep, noun, case, num, anim, rel = key.split('__')
-            for file in conllu_files:
-                print(f'Loading data from {file}...')
-                tokenlists = self.get_tokenlists_from_conllu(file)
-                for tokenlist in tqdm.tqdm(tokenlists):
-                    for token in tokenlist:
-                        if token['lemma'].lower() == verb:
-                            for verb_child in tokenlist:
-                                try:
-                                    if (verb_child['head'] == token['id']) and \
-                                        (verb_child['upos'] in ['NOUN', 'PROPN']) and \
-                                        (verb_child['lemma'].lower() == noun) and \
-                                        (verb_child['feats']['Case'] == case) and \
-                                        (verb_child['feats']['Number'] == num) and \
-                                        (verb_child['feats']['Animacy'] == anim) and \
-                                        (verb_child['deprel'] == rel):
-                                        num = 0
-                                        for noun_child in tokenlist:
-                                            if (noun_child['head'] == verb_child['id']) and \
-                                                noun_child['upos'] == 'NUM':
-                                                num += 1
-                                        if num == 0:
-                                            if prep != 'NO':
-                                                preposition = []
-                                                for noun_child in tokenlist:
-                                                    if (noun_child['head'] == verb_child['id']) and \
-                                                        (noun_child['upos'] == 'ADP') and \
-                                                        (noun_child['deprel'] == 'case'):
-                                                        preposition.append(noun_child['form'].lower())
-                                                        for adp_child in tokenlist:
-                                                            if (adp_child['head'] == noun_child['id']) and \
-                                                                (adp_child['deprel'] == 'fixed'):
-                                                                preposition.append(adp_child['form'].lower())
-                                                if ' '.join(preposition) == prep:
-                                                    examples[key].append(tokenlist.metadata['text'])
-                                            else:
-                                                examples[key].append(tokenlist.metadata['text'])
-                                except:
-                                    pass
-        return examples
\ No newline at end of file
+        for file in conllu_files:
+            if file[:-7]+'.examples.json' in self.json_local:
+                with open(self.DIR_JSON+'/'+file[:-7]+'.examples.json', encoding='utf-8') as examples_file:
+                    texts = json.load(examples_file)
+                for key in freq_dict.keys():
+                    examples[key].extend(texts.get(key, []))
+                continue
+            index = self.read_index(file)
+            if index is not None:
+                with open(self.DIR_CONLLU+'/'+file, 'rb') as conllu_file:
+                    for key in freq_dict.keys():
+                        for offset in index.get(key, []):
+                            for tokenlist in self._read_paragraph(conllu_file, offset):
+                                if key in itertools.chain(*self._extract_all(tokenlist)[7:]):
+                                    examples[key].append(tokenlist.metadata['text'])
+                continue
+            # files without an index are scanned once for all combinations
+            print(f'Loading data from {file}...')
+            for sentence in tqdm.tqdm(self.iter_tokenlists_from_conllu(file, compact=self.compact)):
+                for key in dict.fromkeys(itertools.chain(*self._extract_all(sentence)[7:])):
+                    if key in freq_dict:
+                        examples[key].append(sentence.metadata['text'])
+        return examples
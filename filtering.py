@@ -1,39 +1,97 @@
+# Фильтрация статистики жанров, разбитая на этапы:
+# clean_xad -> фильтры глаголов (1)-(7) -> фильтрация сочетаний -> transform_and_save и индекс сочетаний.
+# Каждый этап объявляет входные и выходные файлы; результаты этапов сохраняются в `data/stages`,
+# и этап пропускается, если его выходные файлы есть, а входные не изменились с прошлого запуска.
+# Жанры загружаются в память по одному (или по одному на процесс, если GENRE_WORKERS > 1).
+#
+# usage:
+# python3 filtering.py                    для каждого этапа печатается время и прирост пикового RSS процесса
+# python3 filtering.py --trace-memory     и пиковая память, выделенная на этапе (tracemalloc, замедляет этапы в 2-3 раза)
+
+import os
 import re
+import time
+import sys
 import random
+import resource
+import tracemalloc
 import tqdm
 import json
+import multiprocessing
+import numpy as np
+from aggregate import checksum
+from morph_cache import MorphCache
+import verb_index
 
-with open('data/all.json', encoding='utf-8') as file:
-    all_genres = json.load(file)
-with open('data/science.json', encoding='utf-8') as file:
-    science = json.load(file)
-with open('data/fiction.json', encoding='utf-8') as file:
-    fiction = json.load(file)
-with open('data/news.json', encoding='utf-8') as file:
-    news = json.load(file)
-with open('data/wiki.json', encoding='utf-8') as file:
-    wiki = json.load(file)
-    
-genres_stats = [fiction, news, science, wiki, all_genres]
 genres_names = ['fiction', 'news', 'science', 'wiki', 'all']
 
-# сохраняем исходную информацию
-initial = {}
-for name, stat in zip(genres_names, genres_stats):
-    initial[name] = {
-        'verbs': len(stat['verbs']),
-        'prepositions': len(stat['prepositions']),
-        'nouns': len(stat['nouns']),
-        'combinations': len(stat['combinations'])
-    }
+# результаты этапов и манифест с контрольными суммами их входных файлов
+DIR_STAGES = 'data/stages'
+# число процессов для этапов, которые выполняются для каждого жанра отдельно
+GENRE_WORKERS = 1
+# измерять пиковую память каждого этапа через tracemalloc (см. `execute_stage`)
+TRACE_MEMORY = False
+
+
+def load(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+def save(obj, path):
+    object_json = json.dumps(obj, ensure_ascii=False)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(object_json)
+
+def stage_path(name):
+    return DIR_STAGES+'/'+name+'.json'
+
+def genre_name(path):
+    return os.path.basename(path).split('.')[0].split('_')[0]
+
+def execute_stage(stage):
+    name, function, inputs, outputs = stage
+    start = time.perf_counter()
+    # ru_maxrss — пик за всё время процесса, поэтому печатается его прирост на этапе (0, если этап не превысил пик предыдущих);
+    # tracemalloc показывает пиковую память самого этапа, но замедляет выделение памяти, поэтому включается только по TRACE_MEMORY
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    try:
+        function(*inputs, *outputs)
+        traced = tracemalloc.get_traced_memory()[1] if TRACE_MEMORY else None
+    finally:
+        if TRACE_MEMORY:
+            tracemalloc.stop()
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    return f'Stage `{name}`: {time.perf_counter() - start:.1f} s, peak RSS growth {growth/1024:.0f} MB' + \
+        (f', peak memory {traced/2**20:.0f} MB' if traced is not None else '')
+
+def run_stages(stages, workers=1):
+    '''Runs stages `(name, function, inputs, outputs)`: `function(*inputs, *outputs)` reads input files and writes output files.
+    A stage is skipped if its outputs exist and checksums of its inputs have not changed since the last run.
+    Independent stages are run in `workers` processes. Prints time and peak RSS growth of each stage
+    (and peak memory allocated by the stage if TRACE_MEMORY is True).'''
+    manifest_path = stage_path('manifest')
+    manifest = load(manifest_path) if os.path.exists(manifest_path) else {}
+    stale = []
+    for stage in stages:
+        name, _, inputs, outputs = stage
+        signature = {path: checksum(path) for path in inputs}
+        if (manifest.get(name) == signature) and all([os.path.exists(path) for path in outputs]):
+            print(f'Stage `{name}`: skipped, inputs have not changed')
+        else:
+            stale.append((stage, signature))
+    if (workers > 1) and (len(stale) > 1):
+        with multiprocessing.get_context('fork').Pool(min(workers, len(stale))) as pool:
+            reports = pool.map(execute_stage, [stage for stage, _ in stale])
+    else:
+        reports = [execute_stage(stage) for stage, _ in stale]
+    for (stage, signature), report in zip(stale, reports):
+        print(report)
+        manifest[stage[0]] = signature
+    save(manifest, manifest_path)
 
-# сюда будем сохранять количество отфильтрованных токенов
-filtered = {}
 
-initial_json = json.dumps(initial, ensure_ascii=False)
-with open('data/initial.json', 'w', encoding='utf-8') as file:
-    file.write(initial_json) 
-    
 # уберем '\xad' из всех списков
 def clean_xad(freq_dict):
     incorrect = [item for item in freq_dict if '\xad' in item]
@@ -45,10 +103,19 @@ def clean_xad(freq_dict):
             freq_dict[correct] = freq_dict[item]
         freq_dict.pop(item)
     return freq_dict
-    
-for name, stat in zip(genres_names, genres_stats):
 
-    print(name)
+def clean_genre(genre_path, clean_path, counts_path):
+    stat = load(genre_path)
+
+    # сохраняем исходную информацию
+    initial = {
+        'verbs': len(stat['verbs']),
+        'prepositions': len(stat['prepositions']),
+        'nouns': len(stat['nouns']),
+        'combinations': len(stat['combinations'])
+    }
+
+    print(genre_name(genre_path))
     print('-'*30)
 
     verbs_n = len(stat['verbs'])
@@ -68,192 +135,172 @@ for name, stat in zip(genres_names, genres_stats):
     print('Combinations:', len(stat['combinations'])/combs_n)
     print('\n')
 
-    filtered[name] = {
+    # сюда будем сохранять количество отфильтрованных токенов
+    filtered = {
         'verbs': verbs_n - len(stat['verbs']),
         'prepositions': preps_n - len(stat['prepositions']),
         'nouns': nouns_n - len(stat['nouns']),
         'combinations': combs_n - len(stat['combinations'])
     }
-    
+    # дальше нужны только глаголы и сочетания
+    save({'verbs': stat['verbs'], 'combinations': stat['combinations']}, clean_path)
+    save({'initial': initial, 'filtered': filtered}, counts_path)
+
+
 # фильтрация глаголов
-verbs = all_genres['verbs'].keys()
+# словарь глаголов представлен массивами глаголов и их частот, фильтр возвращает булеву маску над массивом;
+# глаголы хранятся в массиве объектов: в массиве строк фиксированной ширины каждый элемент был бы длиной в самый длинный
+# "глагол" (например, похожий на URL, которые удаляет фильтр 2); строковые проверки выполняются по одному разу для каждого глагола
+def verb_arrays(verbs):
+    return np.array(list(verbs), dtype=object), np.fromiter(verbs.values(), dtype=np.int64, count=len(verbs))
+
+def verb_mask(verbs, condition):
+    return np.fromiter((condition(verb) for verb in verbs.tolist()), dtype=bool, count=len(verbs))
 
 def out(func, sample_size=30):
-    def wrapper(tokens):
-        res = func(tokens)
-        print(f'Filtered: {len(res)} ({round(len(res)/len(tokens)*100, 3)}%)')
+    def wrapper(verbs, counts, active=None):
+        # если задана маска `active`, фильтр применяется только к оставшимся глаголам
+        mask = np.zeros(len(verbs), dtype=bool)
+        if active is None:
+            active = np.ones(len(verbs), dtype=bool)
+        mask[active] = func(verbs[active], counts[active])
+        res = verbs[mask].tolist()
+        print(f'Filtered: {len(res)} ({round(len(res)/active.sum()*100, 3)}%)')
         print('Examples:', str(random.sample(res, sample_size)))
-        return res
+        return mask
     return wrapper
-    
+
 # (1) глаголы, которые оканчиваются на "-ый", "-ий", "-ой"
 @out
-def filter_flexion(verbs):
-    return [verb for verb in verbs if verb[-2:] in ['ый', 'ий', 'ой']]
-
-filtered_flexion = filter_flexion(verbs)
-
+def filter_flexion(verbs, counts):
+    return verb_mask(verbs, lambda verb: verb.endswith(('ый', 'ий', 'ой')))
 
 # (2) глаголы, в которых есть хотя бы один символ, не принадлежащий [а-яА-ЯёЁ_-]
-@out
-def filter_symbols(verbs):
-    return [verb for verb in verbs if re.findall('[^а-яА-ЯёЁ_-]', verb)]
+SYMBOLS = re.compile('[^а-яА-ЯёЁ_-]')
 
-filtered_symbols = filter_symbols(verbs)
+@out
+def filter_symbols(verbs, counts):
+    return verb_mask(verbs, lambda verb: SYMBOLS.search(verb) is not None)
 
 # (3) глаголы с "ё", которые в случае замены "ё" на "е" не образуют новый глагол (те глаголы, у которых при замене нет аналога с "е", оставляем)
 @out
-def filter_yo(verbs):
-    return [verb for verb in verbs if (('ё' in verb) and (re.sub('ё', 'е', verb) in verbs))]
-
-filtered_yo = filter_yo(verbs)
+def filter_yo(verbs, counts):
+    vocabulary = set(verbs.tolist())
+    return verb_mask(verbs, lambda verb: ('ё' in verb) and (verb.replace('ё', 'е') in vocabulary))
 
-# (4) глаголы с несколькими "не_"
+# (4) глаголы с несколькими "не_" подряд (то же, что '(не_){2,}')
 @out
-def filter_ne(verbs):
-    return [verb for verb in verbs if re.findall('(не_){2,}', verb)]
-
-filtered_ne = filter_ne(verbs)
-
-# фильтруем глаголы по (1)-(4) фильтрам
-filtered_1234 = set(filtered_flexion + filtered_symbols + filtered_yo + filtered_ne)
+def filter_ne(verbs, counts):
+    return verb_mask(verbs, lambda verb: 'не_не_' in verb)
 
-for name, stat in zip(genres_names, genres_stats):
-    verbs_n = len(stat['verbs'])
-    stat['verbs'] = dict(filter(lambda x: x[0] not in filtered_1234, stat['verbs'].items()))
-    print(name)
-    print('-'*30)
-    print('Vebrs:', len(stat['verbs']) / verbs_n)
-    print('\n')
-    filtered[name]['verbs'] += verbs_n - len(stat['verbs'])
+# (5) глаголы, для которых pymorphy не приводит ни одного разбора с глагольным pos-тэгом
+# разборы pymorphy кэшируются (и сохраняются между запусками) для всех этапов фильтрации
+morph_cache = None
 
-verbs = all_genres['verbs'].keys()
+def get_morph_cache():
+    global morph_cache
+    if morph_cache is None:
+        morph_cache = MorphCache('data/pymorphy_cache.json')
+    return morph_cache
 
-# (5) глаголы, для которых pymorphy не приводит ни одного разбора с глагольным pos-тэгом
-import pymorphy2
-from pymorphy2 import MorphAnalyzer
-pymorphy = MorphAnalyzer()
+def lemma(verb):
+    if 'не_' in verb:
+        return verb[3:]
+    return verb
 
 @out
-def filter_pymorphy(verbs):
-    filtered = []
-    for verb in verbs:
-        lemma = verb
-        if 'не_' in verb:
-            lemma = verb[3:]
-        if not list(set([i.tag.POS for i in pymorphy.parse(lemma)]) & set(['VERB', 'INFN'])):
-            filtered.append(verb)
-    return filtered
-
-filtered_pymorphy = filter_pymorphy(verbs)
+def filter_pymorphy(verbs, counts):
+    return np.fromiter((not get_morph_cache().pos(lemma(verb)) & set(['VERB', 'INFN']) for verb in verbs), dtype=bool, count=len(verbs))
 
 # (6) глаголы, которых нет в opencorpora
 @out
-def filter_verbs_opencorpora(verbs):
-    filtered = []
-    for verb in tqdm.tqdm(verbs):
-        lemma = verb
-        if 'не_' in verb:
-            lemma = verb[3:]
-        parse = [i for i in pymorphy.parse(lemma)]
-        norm = []
-        for i in parse:
-            if type(i.methods_stack[0][0]) == pymorphy2.units.by_lookup.DictionaryAnalyzer:
-                if len(i.methods_stack) > 1:
-                    if type(i.methods_stack[1][0]) != pymorphy2.units.by_analogy.UnknownPrefixAnalyzer:
-                        norm.append(i)
-                else:
-                    norm.append(i)
-        if not norm:
-            filtered.append(verb)
-    return filtered
-
-filtered_verbs_opencorpora = filter_verbs_opencorpora(verbs)
-
-# фильтруем глаголы по (5)-(6) фильтрам
-filtered_56 = set(filtered_pymorphy + filtered_verbs_opencorpora)
-for name, stat in zip(genres_names, genres_stats):
-    verbs_n = len(stat['verbs'])
-    stat['verbs'] = dict(filter(lambda x: x[0] not in filtered_56, stat['verbs'].items()))
-    print(name)
-    print('-'*30)
-    print('Verbs:', len(stat['verbs']) / verbs_n)
-    print('\n')
-    filtered[name]['verbs'] += verbs_n - len(stat['verbs'])
-
-verbs = all_genres['verbs'].keys()
+def filter_verbs_opencorpora(verbs, counts):
+    return np.fromiter((not get_morph_cache().in_dictionary(lemma(verb)) for verb in tqdm.tqdm(verbs)), dtype=bool, count=len(verbs))
 
 # (7) глаголы, частота которых во всем корпусе 3 и меньше (только для глаголов без "не")
 @out
-def filter_freq(verbs):
-    return [verb for verb in verbs if ('не_' not in verb) and (all_genres['verbs'][verb] <= 3)]
+def filter_freq(verbs, counts):
+    return verb_mask(verbs, lambda verb: 'не_' not in verb) & (counts <= 3)
+
+# фильтры считаются по глаголам всего корпуса (all) и затем применяются ко всем жанрам
+def compute_verb_filters(all_clean_path, filters_path):
+    verbs, counts = verb_arrays(load(all_clean_path)['verbs'])
+    # фильтруем глаголы по (1)-(4) фильтрам
+    filtered_1234 = filter_flexion(verbs, counts) | filter_symbols(verbs, counts) | filter_yo(verbs, counts) | filter_ne(verbs, counts)
+    # фильтруем оставшиеся глаголы по (5)-(6) фильтрам
+    filtered_56 = filter_pymorphy(verbs, counts, ~filtered_1234) | filter_verbs_opencorpora(verbs, counts, ~filtered_1234)
+    get_morph_cache().save()
+    filtered_frequency = filter_freq(verbs, counts, ~(filtered_1234 | filtered_56))
+    save({'1234': sorted(verbs[filtered_1234].tolist()), '56': sorted(verbs[filtered_56].tolist()), '7': verbs[filtered_frequency].tolist()}, filters_path)
+
+def filter_genre_verbs(clean_path, filters_path, verbs_path):
+    verbs = load(clean_path)['verbs']
+    filters = load(filters_path)
+    # одна маска удаляемых глаголов жанра по всем фильтрам; множества глаголов фильтров не пересекаются
+    verbs_array = verb_arrays(verbs)[0]
+    removed = np.zeros(len(verbs), dtype=bool)
+    verbs_n = len(verbs)
+    for key in ['1234', '56', '7']:
+        filtered = set(filters[key])
+        removed |= verb_mask(verbs_array, filtered.__contains__)
+        print(genre_name(clean_path))
+        print('-'*30)
+        print('Verbs:', int(len(verbs) - removed.sum()) / verbs_n)
+        print('\n')
+        verbs_n = int(len(verbs) - removed.sum())
+    verbs = {verb: count for (verb, count), remove in zip(verbs.items(), removed) if not remove}
+    save({'verbs': verbs, 'filtered': int(removed.sum())}, verbs_path)
+
+# сохраняем исходную информацию и информацию об количестве отфильтрованных токенов
+def save_counts(*paths):
+    counts_paths, verbs_paths = paths[:len(genres_names)], paths[len(genres_names):2*len(genres_names)]
+    initial_path, filtered_path = paths[2*len(genres_names):]
+    initial = {}
+    filtered = {}
+    for name, counts_path, verbs_path in zip(genres_names, counts_paths, verbs_paths):
+        counts = load(counts_path)
+        initial[name] = counts['initial']
+        filtered[name] = counts['filtered']
+        filtered[name]['verbs'] += load(verbs_path)['filtered']
+    save(initial, initial_path)
+    save(filtered, filtered_path)
 
-filtered_frequency = filter_freq(verbs)
 
-for name, stat in zip(genres_names, genres_stats):
-    verbs_n = len(stat['verbs'])
-    stat['verbs'] = dict(filter(lambda x: x[0] not in filtered_frequency, stat['verbs'].items()))
-    print(name)
-    print('-'*30)
-    print('Verbs:', len(stat['verbs']) / verbs_n)
-    print('\n')
-    filtered[name]['verbs'] += verbs_n - len(stat['verbs'])
-verbs = all_genres['verbs'].keys()
-
-# сохраняем текущую информацию об количестве отфильтрованных глаголов
-filtered_json = json.dumps(filtered, ensure_ascii=False)
-with open('data/_filtered.json', 'w', encoding='utf-8') as file:
-    file.write(filtered_json)
-    
 # фильтрация сочетаний
-def filter_combinations(name, stat):
+# проверка существительного и предлога по словарю не зависит от жанра, поэтому выполняется один раз
+# для каждого сочетания из объединения всех жанров (сочетания каждого жанра входят в all)
+def check_combination(comb):
+    preposition, noun = comb.split('__')[1:3]
+    return get_morph_cache().in_dictionary(noun) and \
+        all([(token == 'NO') or get_morph_cache().in_dictionary(token) for token in preposition.split()])
+
+def check_combinations(*paths):
+    clean_paths, valid_path = paths[:-1], paths[-1]
+    combinations_union = set()
+    for clean_path in clean_paths:
+        combinations_union.update(load(clean_path)['combinations'])
+    valid_combinations = sorted([comb for comb in tqdm.tqdm(combinations_union) if check_combination(comb)])
+    print(get_morph_cache())
+    get_morph_cache().save()
+    save(valid_combinations, valid_path)
+
+def filter_combinations(clean_path, verbs_path, valid_path, final_path, incorrect_path):
     combinations_incorrect = {}
     combinations_new = {}
-    verbs = stat['verbs'].keys()
-    for comb in tqdm.tqdm(stat['combinations']):
-        verb, preposition, noun = comb.split('__')[:3]
-        parse_noun = [i for i in pymorphy.parse(noun)]
-        norm_noun = []
-        for i in parse_noun:
-            if type(i.methods_stack[0][0]) == pymorphy2.units.by_lookup.DictionaryAnalyzer:
-                if len(i.methods_stack) > 1:
-                    if type(i.methods_stack[1][0]) != pymorphy2.units.by_analogy.UnknownPrefixAnalyzer:
-                        norm_noun.append(i)
-                else:
-                    norm_noun.append(i)
-        preposition_split = preposition.split()
-        norm_preposition = []
-        for token in preposition_split:
-            if token == 'NO':
-                norm_preposition.append(token)
-            else:
-                parse_token = [i for i in pymorphy.parse(token)]
-                norm_token = []
-                for i in parse_token:
-                    if type(i.methods_stack[0][0]) == pymorphy2.units.by_lookup.DictionaryAnalyzer:
-                        if len(i.methods_stack) > 1:
-                            if type(i.methods_stack[1][0]) != pymorphy2.units.by_analogy.UnknownPrefixAnalyzer:
-                                norm_token.append(i)
-                        else:
-                            norm_token.append(i)
-                if norm_token:
-                    norm_preposition.append(token)
-        if norm_noun and (len(preposition_split) == len(norm_preposition)) and (verb in verbs):
-            combinations_new[comb] = stat['combinations'][comb]
+    verbs = load(verbs_path)['verbs'].keys()
+    valid_combinations = set(load(valid_path))
+    for comb, count in load(clean_path)['combinations'].items():
+        if (comb in valid_combinations) and (comb.split('__', 1)[0] in verbs):
+            combinations_new[comb] = count
         else:
-            combinations_incorrect[comb] = stat['combinations'][comb]
-    json_filtered = json.dumps(combinations_new, ensure_ascii=False)
-    with open('data/final/'+name+'_final.json', 'w', encoding='utf-8') as file:
-        file.write(json_filtered)
-    json_incorrect = json.dumps(combinations_incorrect, ensure_ascii=False)
-    with open('data/incorrect/'+name+'_incorrect.json', 'w', encoding='utf-8') as file:
-        file.write(json_incorrect)
-        
-for name, stat in zip(genres_names, genres_stats):
-    filter_combinations(name, stat)
+            combinations_incorrect[comb] = count
+    save(combinations_new, final_path)
+    save(combinations_incorrect, incorrect_path)
+
 
 # gреобразуем получившиеся сочетания в формат словаря
-def transform_and_save(name, combinations):
+def transform_and_save(final_path, transformed_path):
+    combinations = load(final_path)
     transformed = {}
     for combination in tqdm.tqdm(combinations):
         # split into verb, preposition, noun and features
@@ -275,6 +322,27 @@ def transform_and_save(name, combinations):
         if noun not in transformed[verb][1][prep][1][feats][1]:
             transformed[verb][1][prep][1][feats][1][noun] = 0
         transformed[verb][1][prep][1][feats][1][noun] += combinations[combination]
-    object_json = json.dumps(transformed, ensure_ascii=False)
-    with open('data/final'+name+'_transformed.json', 'w', encoding='utf-8') as file:
-        file.write(object_json)
\ No newline at end of file
+    save(transformed, transformed_path)
+
+
+if __name__ == '__main__':
+    TRACE_MEMORY = '--trace-memory' in sys.argv
+    os.makedirs(DIR_STAGES, exist_ok=True)
+    os.makedirs('data/final', exist_ok=True)
+    os.makedirs('data/incorrect', exist_ok=True)
+    clean = {name: stage_path(name+'_clean') for name in genres_names}
+    counts = {name: stage_path(name+'_counts') for name in genres_names}
+    verbs = {name: stage_path(name+'_verbs') for name in genres_names}
+    final = {name: 'data/final/'+name+'_final.json' for name in genres_names}
+
+    run_stages([('clean_xad '+name, clean_genre, ['data/'+name+'.json'], [clean[name], counts[name]]) for name in genres_names], GENRE_WORKERS)
+    run_stages([('verb filters', compute_verb_filters, [clean['all']], [stage_path('verb_filters')])])
+    run_stages([('filter verbs '+name, filter_genre_verbs, [clean[name], stage_path('verb_filters')], [verbs[name]]) for name in genres_names], GENRE_WORKERS)
+    run_stages([('counts', save_counts, list(counts.values()) + list(verbs.values()), ['data/initial.json', 'data/_filtered.json'])])
+    run_stages([('check combinations', check_combinations, list(clean.values()), [stage_path('valid_combinations')])])
+    run_stages([('filter combinations '+name, filter_combinations,
+        [clean[name], verbs[name], stage_path('valid_combinations')],
+        [final[name], 'data/incorrect/'+name+'_incorrect.json']) for name in genres_names], GENRE_WORKERS)
+    run_stages([('transform_and_save '+name, transform_and_save, [final[name]], ['data/final/'+name+'_transformed.json']) for name in genres_names], GENRE_WORKERS)
+    # индекс verb -> prep -> feats -> noun, в котором можно искать без загрузки всех сочетаний (см. verb_index.py)
+    run_stages([('verb index '+name, verb_index.convert_json, [final[name]], ['data/final/'+name+'_final.vidx']) for name in genres_names], GENRE_WORKERS)
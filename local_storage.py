@@ -0,0 +1,103 @@
+import os
+import random
+import hashlib
+
+
+class LocalObject:
+    '''Minio object description (the attributes used by `Statistics`).'''
+
+    def __init__(self, bucket_name, object_name, size, etag):
+        self.bucket_name = bucket_name
+        self.object_name = object_name
+        self.size = size
+        self.etag = etag
+
+
+class LocalResponse:
+    '''Minio (urllib3) response reading a byte range of a local file.'''
+
+    def __init__(self, path, offset=0, length=0, fail_after=None):
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.left = length or (os.path.getsize(path) - offset)
+        self.fail_after = fail_after
+
+    def stream(self, amt=1 << 16):
+        while self.left > 0:
+            if self.fail_after is not None:
+                if self.fail_after <= 0:
+                    raise ConnectionError('Connection to the local object store is broken on purpose.')
+                amt = min(amt, self.fail_after)
+                self.fail_after -= amt
+            chunk = self.file.read(min(amt, self.left))
+            if not chunk:
+                break
+            self.left -= len(chunk)
+            yield chunk
+
+    def read(self):
+        return b''.join(self.stream())
+
+    def close(self):
+        self.file.close()
+
+    def release_conn(self):
+        pass
+
+
+class LocalMinio:
+    '''Filesystem-backed stand-in for Minio client: bucket `name` is directory `root/name`,
+    object names are paths relative to it, etags are md5 checksums of the content.
+    Can be passed to `Statistics(minio_client=...)` to work without cosyco.
+    A flaky network can be simulated: with probability `failures` a download breaks after a random number of bytes.'''
+
+    def __init__(self, root, failures=0.0, seed=None):
+        self.root = root
+        self.failures = failures
+        self.random = random.Random(seed)
+        self._etags = {}
+
+    def _path(self, bucket_name, object_name):
+        return os.path.join(self.root, bucket_name, object_name)
+
+    def _etag(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self._etags:
+            md5 = hashlib.md5()
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b''):
+                    md5.update(chunk)
+            self._etags[key] = md5.hexdigest()
+        return self._etags[key]
+
+    def stat_object(self, bucket_name, object_name):
+        path = self._path(bucket_name, object_name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'Object `{object_name}` not found in bucket `{bucket_name}`.')
+        return LocalObject(bucket_name, object_name, os.path.getsize(path), self._etag(path))
+
+    def list_objects(self, bucket_name, prefix='', recursive=False):
+        bucket = os.path.join(self.root, bucket_name)
+        for directory, _, files in os.walk(bucket):
+            for file in sorted(files):
+                object_name = os.path.relpath(os.path.join(directory, file), bucket).replace(os.sep, '/')
+                if object_name.startswith(prefix or ''):
+                    yield self.stat_object(bucket_name, object_name)
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0):
+        size = self.stat_object(bucket_name, object_name).size
+        fail_after = None
+        if self.random.random() < self.failures:
+            fail_after = self.random.randrange(max(size - offset, 1))
+        return LocalResponse(self._path(bucket_name, object_name), offset, length, fail_after)
+
+    def fget_object(self, bucket_name, object_name, file_path):
+        response = self.get_object(bucket_name, object_name)
+        try:
+            with open(file_path, 'wb') as file:
+                for chunk in response.stream(1 << 20):
+                    file.write(chunk)
+        finally:
+            response.close()
+        return self.stat_object(bucket_name, object_name)
@@ -0,0 +1,124 @@
+# Instrumentation of long runs (`Statistics.get_statistics`, downloads, `analyzing.py`):
+# time spent in stages (download, parse, extract, count, serialize, ...), counters of sentences, tokens, skipped malformed
+# paragraphs and swallowed exceptions, rates of sentences and tokens per second.
+#
+# It is configured by environment variables, so a running job does not have to be edited:
+#     VCC_METRICS=metrics.jsonl   append a JSON line with a snapshot of metrics every VCC_METRICS_INTERVAL seconds
+#                                 (60 by default) and at the end of every counted file (with metrics of that file only)
+#     VCC_PROFILE=run.prof        `kill -USR1 <pid>` starts cProfile, the next `kill -USR1 <pid>` stops it and dumps stats
+#                                 to the file (`run.prof.<pid>` for worker processes), e.g. to sample a minute of a long run
+#
+# Metrics are kept per process; worker processes of `get_statistics` return theirs to the main process.
+
+import os
+import sys
+import json
+import time
+import signal
+import cProfile
+import threading
+import contextlib
+from collections import Counter, defaultdict
+
+
+class Metrics:
+    '''Counters and stage timers of a process with periodic JSON-lines snapshots and cProfile on demand.'''
+
+    def __init__(self, path=None, interval=60, profile_path=None):
+        self.path = path
+        self.interval = interval
+        self.profile_path = profile_path
+        self.pid = os.getpid()
+        self.profiler = None
+        self.reset()
+
+    @classmethod
+    def from_environment(cls):
+        metrics = cls(os.environ.get('VCC_METRICS'), float(os.environ.get('VCC_METRICS_INTERVAL', 60)), os.environ.get('VCC_PROFILE'))
+        if metrics.profile_path and hasattr(signal, 'SIGUSR1') and (threading.current_thread() is threading.main_thread()):
+            signal.signal(signal.SIGUSR1, metrics.toggle_profile)
+        return metrics
+
+    def reset(self):
+        '''Clears counters and timers (e.g. in a worker process, which inherited them from the main process).'''
+        self.counters = Counter()
+        self.timers = defaultdict(float)
+        self.start = self.last_emit = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            self.timers[stage] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def state(self):
+        '''Returns counters, timers and elapsed time to be merged into metrics of another process.'''
+        return dict(self.counters), dict(self.timers), time.perf_counter() - self.start
+
+    def merge(self, state):
+        counters, timers, _ = state
+        with self.lock:
+            self.counters.update(counters)
+            for stage, seconds in timers.items():
+                self.timers[stage] += seconds
+
+    def snapshot(self, event='progress', state=None):
+        counters, timers, elapsed = state or self.state()
+        return {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'event': event,
+            'pid': os.getpid(),
+            'elapsed': elapsed,
+            'counters': dict(counters),
+            'timers': dict(timers),
+            'sentences_per_second': counters.get('sentences', 0) / elapsed if elapsed else 0.0,
+            'tokens_per_second': counters.get('tokens', 0) / elapsed if elapsed else 0.0
+        }
+
+    def emit(self, event='progress', state=None):
+        '''Appends a snapshot to the JSON-lines file (if it is configured).
+        If `state` of another process is given (e.g. of one file counted by a worker), it is emitted instead.'''
+        self.last_emit = time.perf_counter()
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(self.snapshot(event, state), ensure_ascii=False) + '\n')
+
+    def tick(self):
+        '''Emits a snapshot if `interval` seconds have passed since the last one. Cheap enough to be called for every sentence.'''
+        if self.path and (time.perf_counter() - self.last_emit >= self.interval):
+            self.emit()
+
+    def toggle_profile(self, signum=None, frame=None):
+        '''Starts cProfile or stops it and dumps stats to `profile_path`.'''
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            print(f'Profiling process {os.getpid()}...', file=sys.stderr)
+        else:
+            self.profiler.disable()
+            path = self.profile_path if os.getpid() == self.pid else f'{self.profile_path}.{os.getpid()}'
+            self.profiler.dump_stats(path)
+            self.profiler = None
+            print(f'Profile of process {os.getpid()} is saved to `{path}`.', file=sys.stderr)
+
+    def __str__(self):
+        elapsed = time.perf_counter() - self.start
+        stages = ', '.join(f'{stage} {seconds:.1f} s' for stage, seconds in sorted(self.timers.items(), key=lambda item: -item[1]))
+        return f'Metrics: {self.counters["sentences"]} sentences, {self.counters["tokens"]} tokens in {elapsed:.1f} s ' + \
+            f'({self.counters["sentences"]/elapsed:.1f} sentences/s, {self.counters["tokens"]/elapsed:.1f} tokens/s); ' + \
+            f'stages: {stages or "-"}; skipped malformed paragraphs: {self.counters["malformed"]}, ' + \
+            f'swallowed exceptions: {self.counters["swallowed_exceptions"]}'
+
+
+metrics = Metrics.from_environment()
@@ -0,0 +1,62 @@
+import os
+import json
+from collections import OrderedDict
+import pymorphy2
+from pymorphy2 import MorphAnalyzer
+
+
+class MorphCache:
+    '''Memoized pymorphy2 analysis of word forms, shared by filtering stages and genres.
+    For each word form it keeps:
+        - the set of POS tags of all its parses,
+        - whether it is dictionary-backed (has a parse from the OpenCorpora dictionary, which is not guessed by UnknownPrefixAnalyzer).
+    The cache can be saved to a json-file and loaded in the next run; `maxsize` bounds it (least recently used forms are dropped).'''
+
+    def __init__(self, path=None, maxsize=None, morph=None):
+        self.path = path
+        self.maxsize = maxsize
+        self.morph = morph or MorphAnalyzer()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                for word, (pos, dictionary) in json.load(file).items():
+                    self.cache[word] = (frozenset(pos), dictionary)
+
+    @staticmethod
+    def _is_dictionary(parse):
+        if type(parse.methods_stack[0][0]) == pymorphy2.units.by_lookup.DictionaryAnalyzer:
+            if len(parse.methods_stack) > 1:
+                return type(parse.methods_stack[1][0]) != pymorphy2.units.by_analogy.UnknownPrefixAnalyzer
+            return True
+        return False
+
+    def analyze(self, word):
+        '''Returns a set of POS tags and dictionary-backed flag of a word form.'''
+        if word in self.cache:
+            self.hits += 1
+            if self.maxsize:
+                self.cache.move_to_end(word)
+            return self.cache[word]
+        self.misses += 1
+        parses = self.morph.parse(word)
+        result = (frozenset([parse.tag.POS for parse in parses]), any([self._is_dictionary(parse) for parse in parses]))
+        self.cache[word] = result
+        if self.maxsize and (len(self.cache) > self.maxsize):
+            self.cache.popitem(last=False)
+        return result
+
+    def pos(self, word):
+        return self.analyze(word)[0]
+
+    def in_dictionary(self, word):
+        return self.analyze(word)[1]
+
+    def save(self):
+        if self.path:
+            with open(self.path, 'w', encoding='utf-8') as file:
+                json.dump({word: [sorted(pos, key=str), dictionary] for word, (pos, dictionary) in self.cache.items()}, file, ensure_ascii=False)
+
+    def __str__(self):
+        return f'Pymorphy cache: {len(self.cache)} forms, {self.hits} hits, {self.misses} pymorphy calls'
@@ -0,0 +1,254 @@
+# Local HTTP query service over combinations of the corpus (`data/final/<genre>_final.json` or statistics json-file),
+# which loads them once and answers queries of notebooks and scripts without reloading and scanning the json-file:
+#
+#     GET /filter?verb=делать&prep=в&prep=на&not_case=Gen&top=20    most frequent combinations matching the criteria
+#                                                                     (see `CombinationsStore.mask`), their number and total count
+#     GET /top?verb=делать&prep=в&top=10                              most frequent verbs, prepositions of a verb, features of
+#                                                                     (verb, prep) or nouns of (verb, prep, feats) (see `VerbIndex`)
+#     GET /examples?combination=делать__в__дом__Loc__Sing__Inan__obl&limit=5
+#                                                                     example sentences (see `Statistics.find_text`), if conllu-files
+#                                                                     and the directory of their indices (`<file>.index.json`
+#                                                                     written by `get_statistics`) are given
+#     GET /stats                                                      number of queries, latency percentiles and cache hits per query type
+#
+# Responses are json; results of queries are kept in an LRU cache of CACHE_SIZE entries. Every response reports its latency
+# (`latency_ms`) and the latency is logged. Combinations are encoded once to `<name>.npz` (`CombinationsStore`) and `<name>.vidx`
+# (`verb_index`) next to the json-file, so the service starts quickly next time. Indices of conllu-files are loaded when
+# they are queried and at most INDICES of them are kept in memory.
+#
+# usage:
+# python3 query_service.py data/final/all_final.json [conllu_dir [index_dir [port]]]
+# (see `benchmark_query_service.py` for a load test)
+
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+from collections import OrderedDict, defaultdict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from combinations_store import CombinationsStore
+from verb_index import VerbIndex, build_verb_index
+from extracting_verb_model import Statistics
+
+
+PORT = 8000
+CACHE_SIZE = 4096
+# number of combinations returned by `filter` and `top` queries by default
+TOP = 20
+# number of latest latencies of each query type kept for percentiles
+LATENCIES = 100000
+# number of indices of conllu-files kept in memory (the least recently used ones are evicted)
+INDICES = 16
+
+
+class QueryService:
+    '''Filter, top-k and example-sentence queries over combinations loaded once, with an LRU cache of results
+    and latency statistics. Can be used directly (`service.query('filter', verb='делать')`) or served over HTTP (`serve`).'''
+
+    def __init__(self, json_path, conllu_dir=None, index_dir=None, cache_size=CACHE_SIZE):
+        start = time.perf_counter()
+        name = json_path[:-5]
+        combinations = None
+        if not os.path.exists(name+'.npz') or (os.path.getmtime(name+'.npz') < os.path.getmtime(json_path)):
+            combinations = self._read_combinations(json_path)
+            CombinationsStore.from_dict(combinations).save(name+'.npz')
+        self.store = CombinationsStore.load(name+'.npz')
+        if not os.path.exists(name+'.vidx') or (os.path.getmtime(name+'.vidx') < os.path.getmtime(json_path)):
+            build_verb_index(combinations or self._read_combinations(json_path), name+'.vidx')
+        self.index = VerbIndex(name+'.vidx')
+        self.statistics = None
+        # conllu-files with indices of sentence byte offsets in `index_dir` (`DIR_JSON` of `Statistics.get_statistics`,
+        # the directory of the json-file by default) and the latest used indices
+        self.indexed = []
+        self.indices = OrderedDict()
+        if conllu_dir:
+            # directories are class attributes of `Statistics`, so they are set on a subclass of the service only
+            statistics = type('ServiceStatistics', (Statistics,), {'DIR_CONLLU': conllu_dir, 'DIR_JSON': index_dir or os.path.dirname(json_path) or '.'})
+            self.statistics = statistics(offline=True, compact=True)
+            self.indexed = [file for file in sorted(os.listdir(conllu_dir)) \
+                if file.endswith('.conllu') and (file[:-7]+'.index.json' in self.statistics.json_local)]
+            if not self.indexed:
+                print(f'No indices of conllu-files of `{conllu_dir}` in `{statistics.DIR_JSON}`: examples are not available.')
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCIES))
+        self.queries = defaultdict(int)
+        self.hits = defaultdict(int)
+        print(f'Loaded {len(self.store)} combinations in {time.perf_counter() - start:.1f} s.')
+
+    @staticmethod
+    def _read_combinations(json_path):
+        with open(json_path, encoding='utf-8') as file:
+            combinations = json.load(file)
+        return combinations.get('combinations', combinations)
+
+    def filter(self, top=TOP, **criteria):
+        '''Returns `top` most frequent combinations which match criteria of `CombinationsStore.mask`,
+        the number of matching combinations and their total count.'''
+        positions = np.flatnonzero(self.store.mask(**criteria))
+        counts = self.store.counts[positions]
+        order = np.argpartition(-counts, top)[:top] if top < len(counts) else np.arange(len(counts))
+        order = order[np.lexsort((order, -counts[order]))]
+        codes = self.store.codes[positions[order]]
+        keys = ['__'.join(self.store.vocabularies[i][code] for i, code in enumerate(row)) for row in codes.tolist()]
+        return {
+            'matches': len(positions),
+            'total': int(counts.sum()),
+            'combinations': [[key, int(count)] for key, count in zip(keys, counts[order].tolist())]
+        }
+
+    def top(self, verb=None, prep=None, feats=None, top=TOP):
+        '''Returns `top` most frequent verbs, prepositions of a verb, features of (verb, prep) or nouns of (verb, prep, feats).'''
+        path = [value for value in [verb, prep, feats] if value is not None]
+        if path != [verb, prep, feats][:len(path)]:
+            raise ValueError('`prep` needs `verb` and `feats` needs `prep`.')
+        queries = [self.index.verbs, self.index.prepositions, self.index.features, self.index.nouns]
+        return {'count': self.index.count(*path), 'top': queries[len(path)](*path, top=top)}
+
+    def _index(self, file):
+        '''Returns the index of a conllu-file, keeping at most INDICES latest used ones in memory.'''
+        with self.lock:
+            index = self.indices.get(file)
+            if index is not None:
+                self.indices.move_to_end(file)
+                return index
+        index = self.statistics.read_index(file)
+        with self.lock:
+            self.indices[file] = index
+            if len(self.indices) > INDICES:
+                self.indices.popitem(last=False)
+        return index
+
+    def examples(self, combination, limit=10):
+        '''Returns up to `limit` example sentences of a combination (as `Statistics.find_text` does with indices of conllu-files).'''
+        if not self.indexed:
+            raise ValueError('Example sentences need conllu-files with indices: start the service with `conllu_dir` and `index_dir`.')
+        examples = []
+        for file in self.indexed:
+            offsets = self._index(file).get(combination)
+            if not offsets:
+                continue
+            with open(self.statistics.DIR_CONLLU+'/'+file, 'rb') as conllu_file:
+                for offset in offsets:
+                    for sentence in self.statistics._read_paragraph(conllu_file, offset):
+                        if combination in itertools.chain(*self.statistics._extract_all(sentence)[7:]):
+                            examples.append(sentence.metadata['text'])
+                            if len(examples) >= limit:
+                                return {'examples': examples}
+        return {'examples': examples}
+
+    def stats(self):
+        '''Returns the number of queries, cache hits and latency percentiles (ms, of the latest LATENCIES queries) of each query type.'''
+        with self.lock:
+            latencies = {query: np.array(values) * 1000 for query, values in self.latencies.items()}
+            queries = dict(self.queries)
+            hits = dict(self.hits)
+        return {query: {
+            'queries': queries[query],
+            'cache_hits': hits.get(query, 0),
+            'mean_ms': float(values.mean()),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99))
+        } for query, values in latencies.items()}
+
+    QUERIES = {'filter': filter, 'top': top, 'examples': examples}
+
+    def query(self, name, **parameters):
+        '''Answers a query (`filter`, `top` or `examples`) from the cache or computes it. Returns the result and its latency (s).'''
+        start = time.perf_counter()
+        key = (name, tuple(sorted((parameter, tuple(value) if isinstance(value, list) else value) for parameter, value in parameters.items())))
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                self.hits[name] += 1
+        if result is None:
+            result = self.QUERIES[name](self, **parameters)
+            with self.lock:
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.queries[name] += 1
+            self.latencies[name].append(latency)
+        return result, latency
+
+    def close(self):
+        self.index.close()
+
+
+def parse_parameters(query_string):
+    '''Converts a query string to parameters of a query: `top` and `limit` are integers, repeated parameters are lists.'''
+    parameters = {}
+    for name, values in parse_qs(query_string, keep_blank_values=True).items():
+        if name in ['top', 'limit']:
+            parameters[name] = int(values[-1])
+        else:
+            parameters[name] = values if len(values) > 1 else values[0]
+    return parameters
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    # connections are kept alive between queries; without TCP_NODELAY a response would wait for a delayed ACK (~40 ms)
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    service = None
+    quiet = False
+
+    def _reply(self, code, result):
+        data = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.log_message('"%s" %d %.2f ms', self.path, code, (time.perf_counter() - self.start) * 1000)
+
+    def do_GET(self):
+        self.start = time.perf_counter()
+        url = urlsplit(self.path)
+        name = url.path.strip('/')
+        if name == 'stats':
+            return self._reply(200, self.service.stats())
+        if name not in self.service.QUERIES:
+            return self._reply(404, {'error': f'Unknown query `{name}`. Queries are: {list(self.service.QUERIES)} and stats.'})
+        try:
+            result, latency = self.service.query(name, **parse_parameters(url.query))
+        except (KeyError, TypeError, ValueError) as error:
+            return self._reply(400, {'error': str(error)})
+        result = dict(result, latency_ms=latency * 1000)
+        self._reply(200, result)
+
+    def log_request(self, code='-', size='-'):
+        # requests are logged with their latency by `_reply`
+        pass
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def serve(service, port=PORT, quiet=False):
+    '''Returns an HTTP server of the service on localhost (call its `serve_forever`).'''
+    handler = type('Handler', (QueryHandler,), {'service': service, 'quiet': quiet})
+    return ThreadingHTTPServer(('127.0.0.1', port), handler)
+
+
+if __name__ == '__main__':
+    service = QueryService(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None, sys.argv[3] if len(sys.argv) > 3 else None)
+    server = serve(service, int(sys.argv[4]) if len(sys.argv) > 4 else PORT)
+    print(f'Serving on http://127.0.0.1:{server.server_address[1]}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    service.close()
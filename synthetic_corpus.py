@@ -0,0 +1,159 @@
+# Generator of synthetic conllu-files shaped like the syntax-parsed corpus of cosyco, for benchmarks and offline runs.
+#
+# Sentences are built around verbs with Zipf-distributed lemmas of verbs, nouns, adjectives and prepositions
+# (prepositions and their cases are taken from `prepositional_government.json`, multiword ones are joined by `fixed` relation).
+# A sentence has a log-normally distributed length (median about 13 tokens) and contains:
+#     - one or two clauses with a verb (negated by `не` in some of them),
+#     - a subject (`nsubj`), an object (`obj`) and up to two prepositional objects (`obl`) of a verb,
+#     - adjectives (`amod`), numerals (`nummod`) and genitive nouns (`nmod`) of nouns, adverbs of verbs and punctuation.
+# A small share of prepositional objects has a case not governed by the preposition (`filtered` combinations of statistics),
+# and some nouns lack the animacy feature. Paragraphs can be made malformed on purpose (`malformed` share).
+#
+# usage:
+# python3 synthetic_corpus.py output_dir sentences [files] [seed]
+
+import os
+import sys
+import json
+import math
+import random
+import itertools
+
+
+SYLLABLES = [consonant + vowel for consonant in 'бвгдзклмнпрстфхчшж' for vowel in 'аеиоуыя']
+CASES = ['Nom', 'Gen', 'Dat', 'Acc', 'Ins', 'Loc']
+
+
+def zipf(n, s=1.07):
+    '''Returns cumulative weights of a Zipf distribution over n ranks (for `random.choices`).'''
+    return list(itertools.accumulate([1 / rank ** s for rank in range(1, n + 1)]))
+
+
+class SyntheticCorpus:
+    '''Random (but reproducible with `seed`) sentences in conllu format with vocabularies of given sizes.'''
+
+    def __init__(self, seed=0, verbs=3000, nouns=15000, adjectives=3000, malformed=0.0,
+            prepositional_government='prepositional_government.json'):
+        self.random = random.Random(seed)
+        self.malformed = malformed
+        self.verbs = self._vocabulary(verbs, ['ать', 'ить', 'еть', 'овать', 'аться', 'иться'])
+        self.nouns = self._vocabulary(nouns, ['', 'а', 'ость', 'ение', 'ник', 'о'])
+        self.adjectives = self._vocabulary(adjectives, ['ый', 'ий', 'ой'])
+        self.adverbs = self._vocabulary(200, ['о', 'е'])
+        with open(prepositional_government, encoding='utf-8') as file:
+            self.government = json.load(file)
+        self.prepositions = list(self.government)
+        self.weights = {
+            'verbs': zipf(len(self.verbs)),
+            'nouns': zipf(len(self.nouns)),
+            'adjectives': zipf(len(self.adjectives)),
+            'adverbs': zipf(len(self.adverbs)),
+            'prepositions': zipf(len(self.prepositions), 1.5)
+        }
+        self.sentences = 0
+
+    def _vocabulary(self, size, endings):
+        words = set()
+        while len(words) < size:
+            stem = ''.join(self.random.choices(SYLLABLES, k=self.random.randint(1, 3)))
+            words.add(stem + self.random.choice(endings))
+        return sorted(words)
+
+    def _choice(self, name):
+        return self.random.choices(getattr(self, name), cum_weights=self.weights[name])[0]
+
+    def _noun(self, tokens, head, deprel, case, preposition=None):
+        '''Appends a noun phrase (adjective, preposition with fixed parts, numeral, noun) and returns the id of the noun.'''
+        words = preposition.split() if preposition else []
+        adjective = self.random.random() < 0.3
+        noun_id = len(tokens) + 1 + len(words) + adjective
+        feats = {'Case': case, 'Number': 'Plur' if self.random.random() < 0.25 else 'Sing', 'Gender': self.random.choice(['Masc', 'Fem', 'Neut'])}
+        if self.random.random() < 0.98:
+            feats['Animacy'] = 'Anim' if self.random.random() < 0.2 else 'Inan'
+        if words:
+            first = len(tokens) + 1
+            tokens.append([words[0], words[0], 'ADP', {}, noun_id, 'case'])
+            for word in words[1:]:
+                tokens.append([word, word, 'ADP', {}, first, 'fixed'])
+        if adjective:
+            adjective = self._choice('adjectives')
+            tokens.append([adjective, adjective, 'ADJ', {'Case': case}, noun_id, 'amod'])
+        noun = self._choice('nouns')
+        upos = 'PROPN' if self.random.random() < 0.05 else 'NOUN'
+        tokens.append([noun.capitalize() if upos == 'PROPN' else noun, noun, upos, feats, head, deprel])
+        if self.random.random() < 0.04:
+            tokens.append(['два', 'два', 'NUM', {}, noun_id, 'nummod'])
+        return noun_id
+
+    def _clause(self, tokens, length, head=0, deprel='root'):
+        verb_id = len(tokens) + 1
+        verb = self._choice('verbs')
+        tokens.append([verb, verb, 'VERB', {'Aspect': self.random.choice(['Imp', 'Perf'])}, head, deprel])
+        if self.random.random() < 0.12:
+            tokens.append(['не', 'не', 'PART', {}, verb_id, 'advmod'])
+        if self.random.random() < 0.7:
+            self._noun(tokens, verb_id, 'nsubj', 'Nom')
+        if self.random.random() < 0.5:
+            self._noun(tokens, verb_id, 'obj', self.random.choice(['Acc', 'Acc', 'Acc', 'Gen']))
+        for _ in range(self.random.choice([0, 1, 1, 2])):
+            preposition = self.random.choices(self.prepositions, cum_weights=self.weights['prepositions'])[0]
+            cases = self.government[preposition]
+            case = self.random.choice(cases if self.random.random() < 0.95 else CASES)
+            self._noun(tokens, verb_id, 'obl', case, preposition)
+        nouns = [i for i, token in enumerate(tokens[verb_id:], verb_id + 1) if token[2] in ['NOUN', 'PROPN']]
+        while len(tokens) < length:
+            if nouns and (self.random.random() < 0.4):
+                self._noun(tokens, self.random.choice(nouns), 'nmod', 'Gen')
+            else:
+                adverb = self._choice('adverbs')
+                tokens.append([adverb, adverb, 'ADV', {}, verb_id, 'advmod'])
+        return verb_id
+
+    def sentence(self):
+        '''Returns a sentence (a paragraph of conllu-file).'''
+        self.sentences += 1
+        length = max(3, round(self.random.lognormvariate(math.log(13), 0.5)))
+        tokens = []
+        root = self._clause(tokens, length if self.random.random() < 0.7 else length // 2)
+        if len(tokens) < length:
+            tokens.append([',', ',', 'PUNCT', {}, len(tokens) + 2, 'punct'])
+            self._clause(tokens, length, root, 'conj')
+        tokens.append(['.', '.', 'PUNCT', {}, root, 'punct'])
+        lines = [f'# sent_id = {self.sentences}', '# text = ' + ' '.join(token[0] for token in tokens)]
+        for i, (form, lemma, upos, feats, head, deprel) in enumerate(tokens, 1):
+            feats = '|'.join(f'{key}={value}' for key, value in sorted(feats.items())) or '_'
+            lines.append('\t'.join([str(i), form, lemma, upos, '_', feats, str(head), deprel, '_', '_']))
+        if self.random.random() < self.malformed:
+            # head, which is not a number, makes conllu fail to parse the paragraph
+            lines[-1] = lines[-1].replace(f'\t{root}\tpunct', '\tx\tpunct')
+        return '\n'.join(lines) + '\n\n'
+
+    def write(self, path, sentences):
+        '''Writes a conllu-file of `sentences` sentences.'''
+        with open(path, 'w', encoding='utf-8') as file:
+            for _ in range(sentences):
+                file.write(self.sentence())
+        return path
+
+
+def write_bucket(root, files, sentences, seed=0, **kwargs):
+    '''Writes `files` conllu-files of `sentences` sentences each in the layout of cosyco bucket for `local_storage.LocalMinio(root)`
+    (`root/public/syntax-parsed/synthetic_<i>.conllu`). Returns names of the files.'''
+    directory = os.path.join(root, 'public', 'syntax-parsed')
+    os.makedirs(directory, exist_ok=True)
+    corpus = SyntheticCorpus(seed, **kwargs)
+    names = [f'synthetic_{i}.conllu' for i in range(files)]
+    for name in names:
+        corpus.write(os.path.join(directory, name), sentences)
+    return names
+
+
+if __name__ == '__main__':
+    output_dir = sys.argv[1]
+    sentences = int(sys.argv[2])
+    files = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    os.makedirs(output_dir, exist_ok=True)
+    corpus = SyntheticCorpus(seed)
+    for i in range(files):
+        print('Saved:', corpus.write(os.path.join(output_dir, f'synthetic_{i}.conllu'), sentences))
@@ -0,0 +1,224 @@
+# Nested index of combinations verb -> preposition -> features -> noun stored as sorted offset tables.
+#
+# file layout:
+# MAGIC | for each field: strings | offsets (uint64) | for each level: codes (uint32) | counts (int64) | children (uint64) | header (json) | header size (uint64)
+#
+# fields are `verb`, `prep`, `feats` (`case__num__anim__rel`) and `noun`; a vocabulary of a field is its utf-8 encoded values
+# sorted bytewise, offsets[i]:offsets[i+1] are bounds of the i-th value in strings.
+# The i-th level contains nodes of prefixes verb, verb+prep, verb+prep+feats and verb+prep+feats+noun
+# sorted by codes of their fields: codes[j] is the code of the last field of the j-th node, counts[j] is its marginal count,
+# children[j]:children[j+1] are bounds of its children on the next level (children of a node are sorted by codes).
+# The file is opened through mmap, so a lookup reads only a few pages of it.
+#
+# usage (building indices of combinations from json-files of `filtering.py` or of `Statistics.get_statistics`):
+# python3 verb_index.py data/final/all_final.json [...]
+# python3 verb_index.py statistics.json [...]
+
+import sys
+import json
+import mmap
+import itertools
+from array import array
+import numpy as np
+
+
+MAGIC = b'VCCINDX1'
+FIELDS = ['verb', 'prep', 'feats', 'noun']
+
+
+def split_combination(combination):
+    verb, prep, noun, case, num, anim, rel = combination.split('__')
+    return verb, prep, case+'__'+num+'__'+anim+'__'+rel, noun
+
+def build_verb_index(combinations: dict, path):
+    '''Writes a nested index of a frequency dictionary of combinations (`verb__prep__noun__case__num__anim__rel`).
+    Combinations are split in one pass; levels are built from the sorted codes with numpy.'''
+    # values of each field get codes in order of appearance (a dictionary per field, as in `CombinationsStore.from_dict`),
+    # then vocabularies are sorted (by code points, which is the bytewise order of utf-8) and codes are renumbered
+    ids = [{} for _ in FIELDS]
+    flat = array('I')
+    for combination in combinations:
+        flat.extend([field_ids.setdefault(value, len(field_ids)) for field_ids, value in zip(ids, split_combination(combination))])
+    codes = np.frombuffer(flat, dtype=np.uint32).reshape(-1, len(FIELDS)).copy()
+    counts = np.fromiter(combinations.values(), dtype=np.int64, count=len(combinations))
+    vocabularies = []
+    for i, field_ids in enumerate(ids):
+        values = list(field_ids)
+        order = sorted(range(len(values)), key=values.__getitem__)
+        renumbered = np.empty(len(values), dtype=np.uint32)
+        renumbered[order] = np.arange(len(values), dtype=np.uint32)
+        codes[:, i] = renumbered[codes[:, i]]
+        vocabularies.append([values[j] for j in order])
+    order = np.lexsort(codes.T[::-1])
+    codes, counts = codes[order], counts[order]
+    # nodes of the i-th level start at rows where the prefix of the first i+1 fields changes
+    starts = []
+    for i in range(len(FIELDS)):
+        changes = np.any(codes[1:, :i+1] != codes[:-1, :i+1], axis=1)
+        starts.append(np.flatnonzero(np.concatenate([[len(codes) > 0], changes])))
+    header = {'fields': {}, 'levels': []}
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        for field, vocabulary in zip(FIELDS, vocabularies):
+            values = [value.encode('utf-8') for value in vocabulary]
+            offsets = np.zeros(len(values) + 1, dtype=np.uint64)
+            np.cumsum([len(value) for value in values], out=offsets[1:])
+            position = file.tell()
+            file.write(b''.join(values))
+            file.write(b'\0' * (-file.tell() % 8))
+            header['fields'][field] = {'n': len(values), 'strings': position, 'offsets': file.tell()}
+            file.write(offsets.tobytes())
+        for i in range(len(FIELDS)):
+            level = {'n': len(starts[i]), 'codes': file.tell()}
+            file.write(codes[starts[i], i].tobytes())
+            file.write(b'\0' * (-file.tell() % 8))
+            level['counts'] = file.tell()
+            file.write((np.add.reduceat(counts, starts[i]) if len(counts) else counts).tobytes())
+            if i + 1 < len(FIELDS):
+                level['children'] = file.tell()
+                file.write(np.append(np.searchsorted(starts[i+1], starts[i]), len(starts[i+1])).astype(np.uint64).tobytes())
+            header['levels'].append(level)
+        header = json.dumps(header).encode('utf-8')
+        file.write(header)
+        file.write(np.uint64(len(header)).tobytes())
+
+def convert_json(json_path, path=None):
+    '''Builds an index of combinations from a json-file (`<name>.vidx` by default): a frequency dictionary of combinations
+    (`data/final/<genre>_final.json`) or statistics with `combinations`.'''
+    with open(json_path, encoding='utf-8') as file:
+        combinations = json.load(file)
+    if 'combinations' in combinations:
+        combinations = combinations['combinations']
+    path = path or json_path[:-5]+'.vidx'
+    build_verb_index(combinations, path)
+    return path
+
+
+class Vocabulary:
+    '''Sorted values of a field in the index; `find` returns the code of a value by binary search.'''
+
+    def __init__(self, buffer, n, strings, offsets):
+        self.buffer = buffer
+        self.n = n
+        self.strings = strings
+        self.offsets = np.frombuffer(buffer, dtype=np.uint64, count=n+1, offset=offsets)
+
+    def _bytes(self, code):
+        return self.buffer[self.strings+int(self.offsets[code]):self.strings+int(self.offsets[code+1])]
+
+    def __getitem__(self, code):
+        return self._bytes(code).decode('utf-8')
+
+    def find(self, value):
+        value = value.encode('utf-8')
+        low, high = 0, self.n
+        while low < high:
+            middle = (low + high) // 2
+            if self._bytes(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if (low < self.n) and (self._bytes(low) == value):
+            return low
+        return None
+
+
+class VerbIndex:
+    '''Nested index of combinations opened through mmap (see `build_verb_index`).
+    Answers questions like "what does a verb govern" without loading all combinations:
+        index.prepositions('делать', top=10)
+        index.nouns('делать', 'в', 'Loc__Sing__Inan__obl', top=10)
+        index.count('делать', 'в')'''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'File `{path}` is not an index of combinations.')
+        header_size = int(np.frombuffer(self.buffer, dtype=np.uint64, count=1, offset=len(self.buffer)-8)[0])
+        header = json.loads(self.buffer[len(self.buffer)-8-header_size:len(self.buffer)-8])
+        self.vocabularies = [Vocabulary(self.buffer, **header['fields'][field]) for field in FIELDS]
+        self.codes, self.counts, self.children = [], [], []
+        for level in header['levels']:
+            self.codes.append(np.frombuffer(self.buffer, dtype=np.uint32, count=level['n'], offset=level['codes']))
+            self.counts.append(np.frombuffer(self.buffer, dtype=np.int64, count=level['n'], offset=level['counts']))
+            if 'children' in level:
+                self.children.append(np.frombuffer(self.buffer, dtype=np.uint64, count=level['n']+1, offset=level['children']))
+
+    def _find(self, level, start, end, value):
+        code = self.vocabularies[level].find(value)
+        if code is None:
+            return None
+        position = start + int(np.searchsorted(self.codes[level][start:end], code))
+        if (position == end) or (self.codes[level][position] != code):
+            return None
+        return position
+
+    def _children(self, path):
+        '''Returns bounds of children of a node given by a path of field values (None if there is no such node).'''
+        start, end = 0, len(self.codes[0])
+        for level, value in enumerate(path):
+            position = self._find(level, start, end, value)
+            if position is None:
+                return None
+            start, end = int(self.children[level][position]), int(self.children[level][position+1])
+        return start, end
+
+    def _top(self, path, top):
+        bounds = self._children(path)
+        if bounds is None:
+            return []
+        level, (start, end) = len(path), bounds
+        counts = self.counts[level][start:end]
+        if (top is not None) and (top < len(counts)):
+            positions = np.argpartition(-counts, top)[:top]
+        else:
+            positions = np.arange(len(counts))
+        positions = positions[np.lexsort((positions, -counts[positions]))]
+        return [(self.vocabularies[level][int(self.codes[level][start+i])], int(counts[i])) for i in positions]
+
+    def count(self, verb=None, prep=None, feats=None, noun=None):
+        '''Returns the marginal count of a verb, (verb, prep), (verb, prep, feats) or a combination; with no arguments, the total count.
+        Values are a prefix of the path: `prep` needs `verb`, `feats` needs `prep` and `noun` needs `feats`.'''
+        path = list(itertools.takewhile(lambda value: value is not None, [verb, prep, feats, noun]))
+        if len(path) == 0:
+            return int(self.counts[0].sum())
+        bounds = self._children(path[:-1])
+        position = None if bounds is None else self._find(len(path)-1, *bounds, path[-1])
+        if position is None:
+            return 0
+        return int(self.counts[len(path)-1][position])
+
+    def verbs(self, top=None):
+        '''Returns `top` most frequent verbs with their counts.'''
+        return self._top([], top)
+
+    def prepositions(self, verb, top=None):
+        '''Returns `top` most frequent prepositions of a verb with counts of (verb, prep).'''
+        return self._top([verb], top)
+
+    def features(self, verb, prep, top=None):
+        '''Returns `top` most frequent grammar features (`case__num__anim__rel`) of nouns governed by (verb, prep).'''
+        return self._top([verb, prep], top)
+
+    def nouns(self, verb, prep, feats, top=None):
+        '''Returns `top` most frequent nouns of (verb, prep, feats) with their counts.'''
+        return self._top([verb, prep, feats], top)
+
+    def close(self):
+        '''Closes the file. Vocabularies handed out by the index are emptied, so they do not keep views of the mapped file;
+        if a view is still held elsewhere, the file is unmapped when it is released.'''
+        for vocabulary in self.vocabularies:
+            vocabulary.n = 0
+            vocabulary.offsets = np.zeros(1, dtype=np.uint64)
+        self.codes, self.counts, self.children, self.vocabularies = [], [], [], []
+        try:
+            self.buffer.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+
+if __name__ == '__main__':
+    for json_path in sys.argv[1:]:
+        print('Saved:', convert_json(json_path))